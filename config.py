@@ -11,6 +11,74 @@ class ServerConfig:
     format_punc = True  # 输出时是否启用标点符号引擎
     format_spell = True  # 输出时是否调整中英之间的空格
 
+    file_max_wait = 30   # 文件片段最长排队时间（秒），超过后与麦克风片段同级调度，防止饿死
+    mic_vad = False          # 麦克风音频在停顿处切分（silero VAD），片段间不再重叠，每句话说完即可识别
+                             # 一直没有停顿时，仍按客户端的分段长度切分
+    vad_model = Path() / 'models' / 'silero_vad.onnx'   # 下载：https://github.com/snakers4/silero-vad/raw/master/files/silero_vad.onnx
+    vad_silence = 0.5        # 静音超过多少秒算作停顿
+    vad_min_segment = 2      # 停顿处切出的片段至少多少秒，更短的与后面的话合并识别
+    streaming = False        # 麦克风音频同时送进流式模型，边说边推送中间结果，最终文字仍由离线模型识别
+    streaming_model = {'kind': 'paraformer',            # 'paraformer' 或 'transducer'（流式 zipformer）
+                       'encoder': 'models/paraformer-online-zh/encoder.int8.onnx',
+                       'decoder': 'models/paraformer-online-zh/decoder.int8.onnx',
+                       'tokens': 'models/paraformer-online-zh/tokens.txt'}
+    streaming_threads = 2    # 流式模型的线程数
+    file_vad = False         # 转录文件时用 VAD 找出语音区间，只识别有声部分，静音不再送进模型
+    file_vad_batch = 60      # 文件转录时每个识别任务凑多少秒语音，各区间在一次 decode_streams 里批量识别
+    mic_refine = ''          # 两遍识别：听写先用快的模型出初稿（由 model_routes['mic'] 或客户端指定），
+                             # 再用这里指定的准确模型在后台重新识别整段录音，结果不同时给客户端发修正，为空表示不开启
+    mic_speculate = 0        # 听写时每录满多少秒就先识别已录下的部分，松开按键时末尾最多剩这么长再加一个重叠要识别，
+                             # 长句的出字时延不再随句长增加，代价是多出的重叠部分要重复识别，0 表示按客户端的分段长度
+    adaptive_segment = False # 由服务端按负载选择分段长度与重叠，取代客户端的 seg_duration、seg_overlap：
+                             # 空闲时麦克风用短分段、出字快，繁忙时用长分段、短重叠、吞吐量高
+    seg_ranges = {'mic': (8, 20), 'file': (15, 40)}   # 各来源分段长度的范围（秒）
+    overlap_range = (1, 2)   # 重叠的范围（秒），空闲时取长的
+    adaptive_busy = 10       # 识别完积压的音频要多少秒时，算作满负载
+    client_weights = {}  # 按客户端 IP 指定调度权重，未列出的为 1，例如 {'192.168.1.10': 2}
+    mic_latency_budget = 10  # 客户端未指定时，麦克风录音结束后最多等待识别的秒数，超时的片段会被放弃
+
+    min_workers = 1         # 识别进程数下限
+    max_workers = 1         # 识别进程数上限，大于下限时按排队情况自动扩缩容
+    max_memory = 8          # 识别进程合计内存上限（GB），扩容不会超出
+    scale_up_queued = 60    # 排队音频超过多少秒时扩容
+    scale_up_wait = 3       # 排队最久的片段等待超过多少秒时扩容
+    scale_down_idle = 300   # 识别进程空闲多少秒后缩容
+    idle_unload = 0         # 连续多少分钟没有任务就释放模型，客户端连接或发来音频时重新载入，0 表示不释放
+    worker_mode = 'spawn'   # 'spawn'：每个识别进程各自载入模型
+                            # 'prefork'：模型只载入一次，fork 出的识别进程共享模型权重，省内存，
+                            #            但每个识别进程只能单线程推理，仅限 Linux/macOS
+
+    models = {}             # 内置 paraformer 之外的识别模型，名字 -> sherpa-onnx 构造参数，kind 为
+                            # 'paraformer'、'transducer'、'wenet_ctc' 或 'whisper'，例如：
+                            # {'zipformer': {'kind': 'transducer', 'encoder': '...', 'decoder': '...',
+                            #                'joiner': '...', 'tokens': '...'}}
+    model_routes = {}       # 各来源默认用的模型，例如 {'mic': 'zipformer', 'file': 'paraformer'}，未列出的用 paraformer
+    model_memory = 4        # 每个识别进程里常驻模型的内存合计上限（GB），超出时释放最久没用的模型
+
+    admin_token = ''        # 非本机连接发送管理指令（如换用新模型 swap_model）时须附带的口令，为空则只接受本机
+    malloc_arena_max = 2    # Linux 下每个进程的 glibc malloc arena 上限，多线程推理时 arena 多了 RSS 会虚高，0 表示不限制
+    trim_after = 300        # 识别完多长（秒）的音频后，把空闲内存还给系统
+
+    ort_cache = True        # 把标点模型优化后的计算图缓存到 models/ort_cache，之后启动跳过图优化
+    punc_wait = 30          # 标点模型还在载入时，文件转录的最终结果最多等它多少秒，超时则按停顿加标点发出，0 表示不等
+                            # 听写结果要在时延预算内打出，不等，直接按停顿加标点
+    mic_punc = 'model'      # 听写结果的标点：'model' 用标点模型，'pause' 按停顿加标点，更快但不如模型准
+    pause_comma = 0.5       # 按停顿加标点时，字间隔超过多少秒加逗号
+    pause_period = 1.0      # 按停顿加标点时，字间隔超过多少秒加句号
+    punc_batch_wait = 0.02  # 最终结果交给标点模型前，最多再等多少秒，把同时完成的其它最终结果凑成一批推理
+    punc_batch_size = 16    # 标点模型一批最多推理几个最终结果
+    warm_up = True          # 模型载入后先识别几段空白音频、给标点模型跑一句话，免得首个请求变慢
+
+    calibrate = False       # 启动时比较 paraformer 各模型文件（int8 与 fp32）和线程数，选用最快的组合，
+                            # 结果缓存在 models/calibration.json，本机情况不变时不再重测
+    calibrate_clip = ''     # 校准用的参考音频，为空则用白噪声
+
+    cpu_budget = 0          # 识别进程合计可用的 CPU 核数，0 表示全部可用的核，在 max_workers 个进程间平分
+    punc_threads = 1        # 每个识别进程的份额中划给标点模型的线程数，其余给语音模型
+                            # 份额只有 1 个核时，标点模型与语音模型共用这个核
+    ort_spinning = True     # 标点模型的 ONNX Runtime 线程空闲时是否自旋：开启延迟更低，关闭更省 CPU，适合共享主机
+    pin_cpus = False        # 是否把各识别进程绑定到互不重叠的 CPU 核上
+
 
 # 客户端配置
 class ClientConfig:
@@ -33,6 +101,11 @@ class ClientConfig:
 
     trash_punc = '，。,.'        # 识别结果要消除的末尾标点
 
+    correction = 'log'          # 服务端开启两遍识别时，收到更准的修正结果怎么处理：
+                                # 'replace' 删掉初稿重新输出（仅当初稿是最后输出的内容），'log' 记入日记，'' 忽略
+
+    latency_budget = 10         # 录音结束后最多等待识别结果的秒数，服务端过载超时后会放弃识别
+
     # Media file splitting and processing settings
     SPLIT_DURATION_SECONDS = 2 * 60 * 60  # Duration in seconds to split media files (2 hours)
     # SPLIT_DURATION_SECONDS = 30  # 测试用
@@ -67,6 +140,10 @@ class ClientConfig:
     file_seg_duration = 25           # 转录文件时分段长度
     file_seg_overlap = 2             # 转录文件时分段重叠
 
+    mic_model = ''                  # 听写用的模型名，须在服务端 ServerConfig.models 里登记，为空则由服务端决定
+    file_model = ''                 # 转录文件用的模型名
+    split_channels = False          # 转录文件时各声道分开识别（如双声道的访谈、通话录音），结果按时间合并并标注声道
+
     boot_auto_start = False           # 是否开机自启 core_client, 默认关闭
 
 
@@ -80,7 +157,7 @@ class ModelPaths:
 class ParaformerArgs:
     paraformer = f'{ModelPaths.paraformer_path}'
     tokens = f'{ModelPaths.tokens_path}'
-    num_threads = 6
+    num_threads = 6         # 语音模型线程数上限，实际线程数由 ServerConfig.cpu_budget 划分
     sample_rate = 16000
     feature_dim = 80
     decoding_method = 'greedy_search'
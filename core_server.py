@@ -1,25 +1,38 @@
 import os
 import sys
+import time
 import asyncio
-from multiprocessing import Process, Manager
-from platform import system
+from multiprocessing import Process
 
 import websockets
 from config import ServerConfig as Config
-from util.server_cosmic import Cosmic, console
+from util.server_cosmic import Cosmic, console, spawn_context
 from util.server_check_model import check_model
+from util.server_calibrate import calibrate
 from util.server_ws_recv import ws_recv
 from util.server_ws_send import ws_send
-from util.server_init_recognizer import init_recognizer
-from util.empty_working_set import empty_current_working_set
+from util.server_workers import WorkerPool
+from util.server_streaming import start_streamer
+from util.asyncio_to_thread import to_thread
+from util.empty_working_set import limit_malloc_arenas
 
 BASE_DIR = os.path.dirname(__file__); os.chdir(BASE_DIR)    # 确保 os.getcwd() 位置正确，用相对路径加载模型
 
 async def main():
+    time_start = time.time()
+
+    # 限制 malloc arena 数量，须在启动其它线程之前
+    limit_malloc_arenas(Config.malloc_arena_max)
 
     # 检查模型文件
     check_model()
 
+    # 校准模型文件与线程数，在子进程里测，免得主进程留下测试时载入的模型
+    if Config.calibrate:
+        process = Process(target=calibrate)
+        process.start()
+        await to_thread(process.join)
+
     console.line(2)
     console.rule('[bold #d55252]CapsWriter Offline Server'); console.line()
     console.print(f'项目地址：[cyan underline]https://github.com/HaujetZhao/CapsWriter-Offline', end='\n\n')
@@ -27,22 +40,25 @@ async def main():
     console.print(f'绑定的服务地址：[cyan underline]{Config.addr}:{Config.port}', end='\n\n')
 
     # 跨进程列表，用于保存 socket 的 id，用于让识别进程查看连接是否中断
-    Cosmic.sockets_id = Manager().list()
-
-    # 负责识别的子进程
-    recognize_process = Process(target=init_recognizer,
-                                args=(Cosmic.queue_in,
-                                      Cosmic.queue_out,
-                                      Cosmic.sockets_id),
-                                daemon=True)
-    recognize_process.start()
-    Cosmic.queue_out.get()
+    Cosmic.sockets_id = spawn_context.Manager().list()
+
+    # 负责识别的子进程，按排队情况自动扩缩容
+    Cosmic.pool = WorkerPool(Cosmic.scheduler,
+                             Cosmic.queue_out,
+                             Cosmic.queue_event,
+                             Cosmic.sockets_id)
+    Cosmic.pool.start()
+
+    # 推送中间结果的流式识别进程，与识别进程同时载入
+    Cosmic.streamer = start_streamer(Cosmic.queue_stream, Cosmic.queue_out)
+    await to_thread(Cosmic.pool.ready.wait)
+
+    console.print(f'服务端启动耗时 {time.time() - time_start:.2f}s', end='\n\n')
     console.rule('[green3]开始服务')
     console.line()
 
-    # 清空物理内存工作集
-    if system() == 'Windows':
-        empty_current_working_set()
+    # 把启动时的临时内存还给系统
+    Cosmic.pool.trim_main()
 
     # 负责接收客户端数据的 coroutine
     recv = websockets.serve(ws_recv,
@@ -71,6 +87,7 @@ def init():
         print(e)
     finally:
         Cosmic.queue_out.put(None)
+        Cosmic.queue_stream.put(None)
         sys.exit(0)
         # os._exit(0)
      
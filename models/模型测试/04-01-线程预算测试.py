@@ -0,0 +1,94 @@
+"""
+测试识别进程数与每进程线程数的不同组合下，吞吐量与时延的取舍
+
+用法（在项目根目录运行）：
+
+    python "models/模型测试/04-01-线程预算测试.py" [音频文件]
+
+音频只取前 15 秒，不给音频文件时用白噪声代替。
+
+每种组合把同样数量的片段一起排队，由各进程争抢识别，统计：
+    吞吐量：音频总时长 / 墙钟耗时，即实时倍数
+    时延：每个片段从排队到识别完成的耗时，取中位数和 95 分位
+"""
+
+import os
+import sys
+import time
+from multiprocessing import Process, Queue
+from pathlib import Path
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+BASE_DIR = Path(__file__).parents[2]; os.chdir(BASE_DIR); sys.path.insert(0, str(BASE_DIR))
+from config import ParaformerArgs
+from util.server_sample_audio import load_clip
+
+console = Console(highlight=False)
+segments_per_config = 16
+
+
+def worker(threads: int, queue_in: Queue, queue_out: Queue):
+    import sherpa_onnx
+    args = {key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
+    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(**{**args, 'num_threads': threads})
+
+    # 先识别一次，排除首次推理的开销
+    stream = recognizer.create_stream()
+    stream.accept_waveform(16000, np.zeros(16000, dtype=np.float32))
+    recognizer.decode_stream(stream)
+    queue_out.put('ready')
+
+    while (task := queue_in.get()) is not None:
+        time_submit, samples = task
+        stream = recognizer.create_stream()
+        stream.accept_waveform(16000, samples)
+        recognizer.decode_stream(stream)
+        queue_out.put(time.time() - time_submit)
+
+
+def run(workers: int, threads: int, samples: np.ndarray):
+    queue_in, queue_out = Queue(), Queue()
+    processes = [Process(target=worker, args=(threads, queue_in, queue_out)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    for _ in processes:
+        queue_out.get()
+
+    t1 = time.time()
+    for _ in range(segments_per_config):
+        queue_in.put((time.time(), samples))
+    latencies = sorted(queue_out.get() for _ in range(segments_per_config))
+    wall = time.time() - t1
+
+    for p in processes:
+        queue_in.put(None)
+    for p in processes:
+        p.join()
+
+    throughput = len(samples) / 16000 * segments_per_config / wall
+    return throughput, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    cores = os.cpu_count() or 1
+    samples = load_clip(sys.argv[1] if len(sys.argv) > 1 else '', 15)
+    console.print(f'CPU 核数：{cores}，片段时长：{len(samples) / 16000:.1f}s，每组片段数：{segments_per_config}\n')
+
+    table = Table('进程数', '每进程线程', '吞吐量（实时倍数）', '时延中位数', '时延 95 分位')
+    for workers in (1, 2, 4, 8):
+        for threads in (1, 2, 4, 6, 8):
+            if workers * threads > cores:
+                continue
+            throughput, p50, p95 = run(workers, threads, samples)
+            table.add_row(str(workers), str(threads), f'{throughput:.1f}x', f'{p50:.2f}s', f'{p95:.2f}s')
+            console.print(f'  进程 {workers} × 线程 {threads}：{throughput:.1f}x，{p50:.2f}s / {p95:.2f}s')
+
+    console.line()
+    console.print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""
+在本机比较 paraformer 的各个模型文件和线程数，把最快的组合写入校准缓存
+
+用法（在项目根目录运行）：
+
+    python "models/模型测试/05-01-校准模型与线程数.py"
+
+总是重新测量，覆盖已有的缓存。config.py 里开启 ServerConfig.calibrate 后，
+服务端启动时沿用缓存里的结果，缓存不适用于本机当前情况时才会自己重测。
+"""
+
+import os
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parents[2]; os.chdir(BASE_DIR); sys.path.insert(0, str(BASE_DIR))
+from util.server_calibrate import calibrate
+
+
+if __name__ == '__main__':
+    calibrate(force=True)
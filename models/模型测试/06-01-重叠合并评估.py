@@ -0,0 +1,128 @@
+"""
+评估片段重叠合并：比较不同重叠时长下，按 token 对齐合并与原先按时间戳合并的准确率
+
+用法（在项目根目录运行）：
+
+    python "models/模型测试/06-01-重叠合并评估.py" 音频文件 [参考文本.txt]
+
+音频按服务端的方式切成带重叠的片段，各片段单独识别，再分别用两种方法合并，
+与参考文本比较字错率（只比较汉字、字母和数字，忽略标点与空格）。
+不给参考文本时，以按时间戳合并、重叠 2 秒的结果为参考，即服务端原先的默认设置。
+
+另统计重复识别的比例：各片段音频总时长 / 音频时长 - 1，重叠越短，浪费的算力越少。
+"""
+
+import os
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+BASE_DIR = Path(__file__).parents[2]; os.chdir(BASE_DIR); sys.path.insert(0, str(BASE_DIR))
+from config import ParaformerArgs
+from util.server_merge import align
+from util.server_sample_audio import load_clip
+
+console = Console(highlight=False)
+seg_durations = (15, 25)
+seg_overlaps = (2, 1, 0.5)
+
+
+def split(samples: np.ndarray, duration: float, overlap: float):
+    """与服务端相同的切分：每段 duration + overlap 秒，步长 duration 秒，剩余不足 duration + 2 * overlap 的作为最后一段"""
+    segments, offset = [], 0
+    while len(samples) / 16000 >= duration + overlap * 2:
+        segments.append((offset, samples[:int(16000 * (duration + overlap))]))
+        samples = samples[int(16000 * duration):]
+        offset += duration
+    segments.append((offset, samples))
+    return segments
+
+
+def decode(recognizer, segments):
+    results = []
+    for offset, samples in segments:
+        stream = recognizer.create_stream()
+        stream.accept_waveform(16000, samples)
+        recognizer.decode_stream(stream)
+        results.append((offset, len(samples) / 16000, stream.result.tokens, stream.result.timestamps))
+    return results
+
+
+def merge_by_time(results, overlap: float):
+    """服务端原先的合并方法：在重叠窗口中点按时间戳切开，再比较端点处一两个字去重"""
+    merged = []
+    for index, (offset, duration, tokens, timestamps) in enumerate(results):
+        m = next((i for i, t in enumerate(timestamps) if t > overlap / 2), len(timestamps)) if index else 0
+        n = len(timestamps)
+        if index < len(results) - 1:
+            n = next((i for i, t in enumerate(timestamps, start=1) if t > duration - overlap / 2), n)
+        if merged and merged[-2:] == tokens[m:n][:2]:
+            m += 2
+        elif merged and merged[-1:] == tokens[m:n][:1]:
+            m += 1
+        merged += tokens[m:n]
+    return merged
+
+
+def merge_by_alignment(results, overlap: float):
+    merged, times = [], []
+    for offset, duration, tokens, timestamps in results:
+        m = 0
+        if merged:
+            k, m = align(merged, times, tokens, timestamps, offset, overlap)
+            del merged[k:], times[k:]
+        merged += tokens[m:]
+        times += [t + offset for t in timestamps[m:]]
+    return merged
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'[^\w]|_', '', text).lower()
+
+
+def cer(reference: str, hypothesis: str) -> float:
+    """字错率：编辑距离 / 参考文本长度"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, r in enumerate(reference, start=1):
+        current = [i]
+        for j, h in enumerate(hypothesis, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / max(len(reference), 1)
+
+
+def main():
+    if len(sys.argv) < 2:
+        console.print(__doc__)
+        return
+
+    import sherpa_onnx
+    args = {key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
+    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(**args)
+    samples = load_clip(sys.argv[1])
+    console.print(f'音频时长 {len(samples) / 16000:.1f}s\n')
+
+    if len(sys.argv) > 2:
+        reference = normalize(Path(sys.argv[2]).read_text(encoding='utf-8'))
+    else:
+        reference = normalize(''.join(merge_by_time(decode(recognizer, split(samples, 15, 2)), 2)))
+
+    table = Table('分段长度', '重叠', '重复识别', '按时间戳合并字错率', '按对齐合并字错率')
+    for duration in seg_durations:
+        for overlap in seg_overlaps:
+            segments = split(samples, duration, overlap)
+            results = decode(recognizer, segments)
+            waste = sum(len(s) for _, s in segments) / len(samples) - 1
+            by_time = cer(reference, normalize(''.join(merge_by_time(results, overlap))))
+            by_alignment = cer(reference, normalize(''.join(merge_by_alignment(results, overlap))))
+            table.add_row(f'{duration}s', f'{overlap}s', f'{waste:.1%}', f'{by_time:.2%}', f'{by_alignment:.2%}')
+            console.print(f'{duration}s / {overlap}s 完成')
+    console.print(table)
+
+
+if __name__ == '__main__':
+    main()
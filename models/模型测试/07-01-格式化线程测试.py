@@ -0,0 +1,96 @@
+"""
+测试把最终结果的格式化（加标点、转数字、调空格）移到单独线程后，识别进程的吞吐量变化
+
+用法（在项目根目录运行）：
+
+    python "models/模型测试/07-01-格式化线程测试.py" [音频文件]
+
+音频只取前 15 秒，不给音频文件时用白噪声代替，此时识别结果为空，格式化改用一段固定的长句子。
+
+模拟混合负载：连续识别若干片段，每 final_every 个片段里有一个是最终片段，要格式化。
+    同步：识别完最终片段后，在识别循环里直接格式化，再识别下一个片段
+    线程：最终片段交给格式化线程，识别循环立即识别下一个片段
+统计全部片段识别并格式化完的墙钟耗时，吞吐量为音频总时长 / 墙钟耗时。
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+BASE_DIR = Path(__file__).parents[2]; os.chdir(BASE_DIR); sys.path.insert(0, str(BASE_DIR))
+from config import ParaformerArgs
+from util.server_cpu_budget import plan_threads
+from util.server_punc import load_punc_model, warm_up_punc
+from util.server_recognize import format_text
+from util.server_sample_audio import load_clip
+
+console = Console(highlight=False)
+segments = 24
+final_every = (1, 2, 4)
+sample_text = '今天下午三点我们在二楼会议室开会讨论一下下个季度的预算安排还有新项目的人员配置请大家提前准备好材料'
+
+
+def decode(recognizer, samples) -> str:
+    stream = recognizer.create_stream()
+    stream.accept_waveform(16000, samples)
+    recognizer.decode_stream(stream)
+    return stream.result.text or sample_text
+
+
+def run_inline(recognizer, punc_model, samples, every: int) -> float:
+    t1 = time.time()
+    for i in range(segments):
+        text = decode(recognizer, samples)
+        if i % every == every - 1:
+            format_text(text, punc_model)
+    return time.time() - t1
+
+
+def run_threaded(recognizer, punc_model, samples, every: int) -> float:
+    pending = queue.Queue()
+
+    def format_loop():
+        while (text := pending.get()) is not None:
+            format_text(text, punc_model)
+
+    thread = threading.Thread(target=format_loop)
+    t1 = time.time()
+    thread.start()
+    for i in range(segments):
+        text = decode(recognizer, samples)
+        if i % every == every - 1:
+            pending.put(text)
+    pending.put(None)
+    thread.join()
+    return time.time() - t1
+
+
+def main():
+    import sherpa_onnx
+    threads = plan_threads(0)
+    args = {key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
+    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(**{**args, 'num_threads': threads['asr']})
+    punc_model = load_punc_model(threads['punc'])
+    warm_up_punc(punc_model)
+    samples = load_clip(sys.argv[1] if len(sys.argv) > 1 else '', 15)
+    decode(recognizer, samples)
+    console.print(f'语音模型 {threads["asr"]} 线程，标点模型 {threads["punc"]} 线程，'
+                  f'每种情况识别 {segments} 个 {len(samples) / 16000:.0f}s 的片段\n')
+
+    table = Table('最终片段占比', '同步吞吐量', '线程吞吐量', '提升')
+    audio = len(samples) / 16000 * segments
+    for every in final_every:
+        inline = audio / run_inline(recognizer, punc_model, samples, every)
+        threaded = audio / run_threaded(recognizer, punc_model, samples, every)
+        table.add_row(f'1/{every}', f'{inline:.1f}x', f'{threaded:.1f}x', f'{threaded / inline - 1:+.1%}')
+    console.print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+测试标点模型批量推理：模拟多个听写用户同时说完，比较逐个加标点与合成一批加标点的耗时
+
+用法（在项目根目录运行）：
+
+    python "models/模型测试/08-01-标点批量测试.py" [用户数]
+
+默认 20 个用户。每个用户的最终结果取自一组长短不一的听写句子，
+所有结果同时到达，统计：
+    全部完成：最后一个用户拿到带标点结果的耗时
+    平均时延：各用户从到达到拿到结果的平均耗时
+逐个推理时，排在后面的用户要等前面的都做完；批量推理时，大家一起完成。
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+BASE_DIR = Path(__file__).parents[2]; os.chdir(BASE_DIR); sys.path.insert(0, str(BASE_DIR))
+from config import ServerConfig
+from util.server_punc import load_punc_model, warm_up_punc, punctuate_texts
+
+console = Console(highlight=False)
+repeat = 5
+sentences = [
+    '好的我知道了',
+    '明天上午十点在三楼会议室开会',
+    '帮我把这份文件发给张经理顺便抄送给财务部门',
+    '今天下午三点我们在二楼会议室开会讨论一下下个季度的预算安排还有新项目的人员配置请大家提前准备好材料',
+    '这个问题我们之前讨论过了',
+    'hello 大家好今天我们来聊一聊 python 的异步编程',
+    '记得买牛奶鸡蛋和面包',
+    '根据上个月的数据用户留存率提高了百分之五但是新用户的转化率有所下降我们需要分析一下原因',
+]
+
+
+def run_sequential(punc_model, texts):
+    t1, latencies = time.time(), []
+    for text in texts:
+        punc_model(text)
+        latencies.append(time.time() - t1)
+    return time.time() - t1, sum(latencies) / len(latencies)
+
+
+def run_batched(punc_model, texts):
+    t1 = time.time()
+    punctuate_texts(punc_model, texts)
+    return time.time() - t1, time.time() - t1
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    texts = [sentences[i % len(sentences)] for i in range(users)]
+    punc_model = load_punc_model(ServerConfig.punc_threads)
+    warm_up_punc(punc_model)
+    console.print(f'{users} 个用户同时说完，标点模型 {ServerConfig.punc_threads} 线程，每种方式测 {repeat} 遍取中位数\n')
+
+    table = Table('方式', '全部完成', '平均时延')
+    for name, run in (('逐个推理', run_sequential), ('批量推理', run_batched)):
+        runs = sorted(run(punc_model, texts) for _ in range(repeat))
+        total, mean = runs[repeat // 2]
+        table.add_row(name, f'{total * 1000:.0f}ms', f'{mean * 1000:.0f}ms')
+    console.print(table)
+
+    if getattr(punc_model, 'batch_failed', False):
+        console.print('[yellow]该标点模型不支持批量推理，批量方式已退回逐个推理')
+
+
+if __name__ == '__main__':
+    main()
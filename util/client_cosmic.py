@@ -23,3 +23,5 @@ class Cosmic:
     audio_files = {}
     stream: Union[None, sd.InputStream] = None
     kwd_list: List[str] = []
+    drafts = {}                 # 两遍识别时已输出的初稿：task_id -> (文本, 录音文件)，等待修正
+    last_typed = ''             # 最后输出的结果的 task_id，只有它的初稿可以删掉重打
@@ -10,7 +10,30 @@ from util.client_hot_sub import hot_sub
 from util.client_rename_audio import rename_audio
 from util.client_strip_punc import strip_punc
 from util.client_write_md import write_md
-from util.client_type_result import type_result
+from util.client_type_result import type_result, retype_result
+
+
+MAX_DRAFTS = 20     # 最多为多少条初稿等待修正
+
+
+async def correct_result(message):
+    """按 Config.correction 处理修正结果：删掉初稿重新输出，或记入日记"""
+    if message['task_id'] not in Cosmic.drafts:
+        return
+    draft, file_audio = Cosmic.drafts.pop(message['task_id'])
+    text = hot_sub(strip_punc(message['text']))
+    if text == draft:
+        return
+
+    if Config.correction == 'replace' and Cosmic.last_typed == message['task_id'] and not Cosmic.on:
+        await retype_result(draft, text)
+        console.print(f'    已修正：[green]{text}')
+    elif Config.save_audio and file_audio:
+        write_md(text, message['time_start'], file_audio)
+        console.print(f'    修正结果已记入日记：[green]{text}')
+    else:
+        console.print(f'    修正结果：[green]{text}')
+    console.line()
 
 
 async def recv_result():
@@ -22,13 +45,41 @@ async def recv_result():
             # 接收消息
             message = await Cosmic.websocket.recv()
             message = json.loads(message)
+
+            # 服务端状态消息：空闲释放模型后重新载入中
+            if message.get('type') == 'status':
+                if message['state'] == 'warming_up':
+                    console.print('    [yellow]服务端正在重新载入模型，首次识别会稍慢')
+                elif message['state'] == 'cold':
+                    console.print('    [bright_black]服务端空闲已久，已释放模型，下次录音时重新载入')
+                elif message.get('asr_ready') and not message.get('punc_ready'):
+                    console.print('    [yellow]服务端标点模型载入中，可以开始听写，就绪前听写结果按停顿加标点，文件转录结果会稍等标点模型')
+                continue
+
+            # 服务端两遍识别得到了更准的结果
+            if message.get('type') == 'correction':
+                await correct_result(message)
+                continue
+
             text = message['text']
+
+            # 流式模型的中间结果，只在控制台显示，松开按键后打字的仍是最终结果
+            if message.get('is_partial'):
+                console.print(f'    [bright_black]{text}', end='\r')
+                continue
+
             delay = message['time_complete'] - message['time_submit']
 
             # 如果非最终结果，继续等待
             if not message['is_final']:
                 continue
 
+            # 服务端过载，超出时延预算的录音被放弃了
+            if message.get('skipped'):
+                console.print(f'    [red]服务端繁忙，超出时延预算，本次录音未识别')
+                console.line()
+                continue
+
             # 消除末尾标点
             text = strip_punc(text)
 
@@ -37,7 +88,9 @@ async def recv_result():
 
             # 打字
             await type_result(text)
+            Cosmic.last_typed = message['task_id']
 
+            file_audio = None
             if Config.save_audio:
                 # 重命名录音文件
                 file_audio = rename_audio(message['task_id'], text, message['time_start'])
@@ -45,6 +98,12 @@ async def recv_result():
                 # 记录写入 md 文件
                 write_md(text, message['time_start'], file_audio)
 
+            # 记下初稿，等修正
+            if Config.correction:
+                Cosmic.drafts[message['task_id']] = (text, file_audio)
+                for task_id in list(Cosmic.drafts)[:-MAX_DRAFTS]:
+                    Cosmic.drafts.pop(task_id)
+
             # 控制台输出
             console.print(f'    转录时延：{delay:.2f}s')
             console.print(f'    识别结果：[green]{text}')
@@ -31,10 +31,10 @@ async def send_message(message):
 
 
 async def send_audio():
-    try:
+    # 生成唯一任务 ID
+    task_id = str(uuid.uuid1())
 
-        # 生成唯一任务 ID
-        task_id = str(uuid.uuid1())
+    try:
 
         # 任务起始时间
         time_start = 0
@@ -80,6 +80,8 @@ async def send_audio():
                     'task_id': task_id,             # 任务 ID
                     'seg_duration': Config.mic_seg_duration,    # 分段长度
                     'seg_overlap': Config.mic_seg_overlap,      # 分段重叠
+                    'latency_budget': Config.latency_budget,    # 时延预算
+                    'model': Config.mic_model,                  # 模型名
                     'is_final': False,              # 是否结束
                     'time_start': time_start,       # 录音起始时间
                     'time_frame': task['time'],     # 该帧时间
@@ -102,6 +104,8 @@ async def send_audio():
                     'task_id': task_id,
                     'seg_duration': 15,
                     'seg_overlap': 2,
+                    'latency_budget': Config.latency_budget,
+                    'model': Config.mic_model,
                     'is_final': True,
                     'time_start': time_start,
                     'time_frame': task['time'],
@@ -110,5 +114,9 @@ async def send_audio():
                 }
                 task = asyncio.create_task(send_message(message))
                 break
+    except asyncio.CancelledError:
+        # 录音被取消，通知服务端放弃已提交的片段
+        await send_message({'type': 'cancel', 'task_id': task_id, 'is_final': False})
+        raise
     except Exception as e:
         print(e)
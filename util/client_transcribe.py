@@ -5,6 +5,7 @@ import sys
 import platform
 import uuid
 from pathlib import Path
+from typing import Dict, List
 import time
 import re
 import wave
@@ -15,6 +16,7 @@ import numpy as np
 import websockets
 import typer
 import colorama
+import srt
 from util import srt_from_txt
 from util.client_cosmic import console, Cosmic
 from util.client_check_websocket import check_websocket
@@ -32,22 +34,40 @@ async def transcribe_check(file: Path):
         console.print(f'文件不存在：{file}')
         return False
 
+# transcribe_send 发出的任务 id，分声道转录时每个声道一个
+task_ids: List[str] = []
+
+
+def count_channels(file: Path) -> int:
+    """用 ffprobe 读取音轨的声道数，读取失败按单声道处理"""
+    ffprobe_cmd = ["ffprobe", "-v", "error", "-select_streams", "a:0",
+                   "-show_entries", "stream=channels", "-of", "csv=p=0", str(file)]
+    try:
+        output = subprocess.run(ffprobe_cmd, capture_output=True, text=True).stdout
+        return max(int(output.split()[0]), 1)
+    except (OSError, ValueError, IndexError):
+        return 1
+
+
 async def transcribe_send(file: Path):
 
     # 获取连接
     websocket = Cosmic.websocket
 
+    # 分声道转录时，各声道作为单独的任务，由服务端的多个识别进程并行识别
+    channels = count_channels(file) if Config.split_channels else 1
+
     # 生成任务 id
-    task_id = str(uuid.uuid1())
-    console.print(f'\n任务标识：{task_id}')
+    task_ids[:] = [str(uuid.uuid1()) for _ in range(channels)]
+    console.print(f'\n任务标识：{", ".join(task_ids)}')
     console.print(f'    处理文件：{file}')
 
-    # 获取音频数据，ffmpeg 输出采样率 16000，单声道，float32 格式
+    # 获取音频数据，ffmpeg 输出采样率 16000，单声道（分声道时为各声道交错），float32 格式
     ffmpeg_cmd = [
         "ffmpeg",
         "-i", file,
         "-f", "f32le",
-        "-ac", "1",
+        "-ac", str(channels),
         "-ar", "16000",
         "-",
     ]
@@ -57,29 +77,33 @@ async def transcribe_send(file: Path):
         console.print("\n[bold red]错误：无法启动 FFmpeg 进程以提取音频。[/bold red]")
         return
     data = process.stdout.read()
-    audio_duration = len(data) / 4 / 16000
-    console.print(f'    音频长度：{audio_duration:.2f}s')
+    samples = np.frombuffer(data[:len(data) // (4 * channels) * 4 * channels], dtype=np.float32)
+    tracks = [samples[i::channels].tobytes() for i in range(channels)] if channels > 1 else [data]
+    audio_duration = len(tracks[0]) / 4 / 16000
+    console.print(f'    音频长度：{audio_duration:.2f}s' + (f'，{channels} 个声道' if channels > 1 else ''))
 
-    # 构建分段消息，发送给服务端
+    # 构建分段消息，发送给服务端，各声道交替发送，好让它们同时开始识别
     offset = 0
     while True:
         chunk_end = offset + 16000*4*60
-        is_final = False if chunk_end < len(data) else True
-        message = {
-            'task_id': task_id,                     # 任务 ID
-            'seg_duration': Config.file_seg_duration,    # 分段长度
-            'seg_overlap': Config.file_seg_overlap,      # 分段重叠
-            'is_final': is_final,                       # 是否结束
-            'time_start': time.time(),              # 录音起始时间
-            'time_frame': time.time(),              # 该帧时间
-            'source': 'file',                       # 数据来源：从文件读的数据
-            'data': base64.b64encode(
-                        data[offset: chunk_end]
-                    ).decode('utf-8'),
-        }
+        is_final = False if chunk_end < len(tracks[0]) else True
+        for task_id, track in zip(task_ids, tracks):
+            message = {
+                'task_id': task_id,                     # 任务 ID
+                'seg_duration': Config.file_seg_duration,    # 分段长度
+                'seg_overlap': Config.file_seg_overlap,      # 分段重叠
+                'model': Config.file_model,                 # 模型名
+                'is_final': is_final,                       # 是否结束
+                'time_start': time.time(),              # 录音起始时间
+                'time_frame': time.time(),              # 该帧时间
+                'source': 'file',                       # 数据来源：从文件读的数据
+                'data': base64.b64encode(
+                            track[offset: chunk_end]
+                        ).decode('utf-8'),
+            }
+            await websocket.send(json.dumps(message))
         offset = chunk_end
         progress = min(offset / 4 / 16000, audio_duration)
-        await websocket.send(json.dumps(message))
         console.print(f'    发送进度：{progress:.2f}s', end='\r')
         if is_final:
             break
@@ -89,8 +113,8 @@ async def transcribe_recv(file: Path):
     # 获取连接
     websocket = Cosmic.websocket
 
-    # 接收结果，并添加超时机制
-    message = None
+    # 接收结果，并添加超时机制，分声道转录时等齐各声道的最终结果
+    finals: Dict[str, dict] = {}
     try:
         # 设置一个较长的超时时间，例如按音频时长的比例计算，或一个固定的较大值
         # 例如：每分钟音频给60秒超时，至少300秒
@@ -99,13 +123,15 @@ async def transcribe_recv(file: Path):
         timeout_seconds = 14400 
 
         async def receive_messages():
-            nonlocal message
             async for msg in websocket:
                 parsed_msg = json.loads(msg)
+                if 'type' in parsed_msg:    # 服务端状态消息
+                    continue
                 console.print(f'    转录进度: {parsed_msg["duration"]:.2f}s', end='\r')
                 if parsed_msg['is_final']:
-                    message = parsed_msg # 将最终消息赋值给外部变量
-                    return # 结束此内部协程
+                    finals[parsed_msg['task_id']] = parsed_msg
+                    if len(finals) == len(task_ids):
+                        return # 结束此内部协程
 
         # 创建一个任务来接收消息
         receive_task = asyncio.create_task(receive_messages())
@@ -152,23 +178,38 @@ async def transcribe_recv(file: Path):
             await Cosmic.websocket.close()
         return
 
-    if message is None:
+    if len(finals) < len(task_ids):
         console.print("\n[bold red]错误：未能从服务器接收到最终消息。[/bold red]")
         return
 
+    # 得到文件名 - 确保输出文件与输入文件在同一目录
+    file_path = Path(file)
+    console.print(f"[dim]Output files will be saved in: {file_path.parent}[/dim]")
+
+    messages = [finals[task_id] for task_id in task_ids]
+    if len(messages) == 1:
+        write_result(file_path, messages[0])
+    else:
+        write_channels(file_path, messages)
+
+    process_duration = max(m['time_complete'] for m in messages) - min(m['time_start'] for m in messages)
+    console.print(f'\033[K    处理耗时：{process_duration:.2f}s')
+    for message in messages:
+        console.print(f'    识别结果：\n[green]{message["text"]}')
+
+
+def write_result(file_path: Path, message: dict):
+    """写入 merge.txt、txt、json，再由 txt 和 json 生成 srt"""
+
     # 解析结果
     text_merge = message['text']
     text_split = re.sub('[，。？]', '\n', text_merge)
     timestamps = message['timestamps']
     tokens = message['tokens']
 
-    # 得到文件名 - 确保输出文件与输入文件在同一目录
-    file_path = Path(file)
     json_filename = file_path.with_suffix(".json")
     txt_filename = file_path.with_suffix(".txt")
     merge_filename = file_path.with_suffix(".merge.txt")
-    
-    console.print(f"[dim]Output files will be saved in: {file_path.parent}[/dim]")
 
     # 写入结果
     with open(merge_filename, "w", encoding="utf-8") as f:
@@ -179,6 +220,27 @@ async def transcribe_recv(file: Path):
         json.dump({'timestamps': timestamps, 'tokens': tokens}, f, ensure_ascii=False)
     srt_from_txt.one_task(txt_filename)
 
-    process_duration = message['time_complete'] - message['time_start']
-    console.print(f'\033[K    处理耗时：{process_duration:.2f}s')
-    console.print(f'    识别结果：\n[green]{message["text"]}')
+
+def write_channels(file_path: Path, messages: List[dict]):
+    """
+    分声道转录的结果：各声道先按单声道写出「文件名.声道N.*」，
+    再把各声道的字幕按开始时间合并，带上声道标签，写出文件本身的 txt、merge.txt、srt
+    """
+    subtitles = []
+    for channel, message in enumerate(messages, start=1):
+        channel_path = file_path.with_name(f'{file_path.stem}.声道{channel}{file_path.suffix}')
+        write_result(channel_path, message)
+        srt_file = channel_path.with_suffix('.srt')
+        if srt_file.exists():
+            for subtitle in srt.parse(srt_file.read_text(encoding='utf-8')):
+                subtitle.content = f'声道{channel}：{subtitle.content.strip()}'
+                subtitles.append(subtitle)
+
+    subtitles.sort(key=lambda subtitle: subtitle.start)
+    lines = [f'[{str(subtitle.start).split(".")[0]}] {subtitle.content}' for subtitle in subtitles]
+    with open(file_path.with_suffix(".merge.txt"), "w", encoding="utf-8") as f:
+        f.write('\n'.join(lines))
+    with open(file_path.with_suffix(".txt"), "w", encoding="utf-8") as f:
+        f.write('\n'.join(subtitle.content for subtitle in subtitles))
+    with open(file_path.with_suffix(".srt"), "w", encoding="utf-8") as f:
+        f.write(srt.compose(subtitles))
@@ -36,3 +36,10 @@ async def type_result(text):
     # 模拟打印
     else:
         keyboard.write(text)
+
+
+async def retype_result(old, new):
+    """删掉刚输出的 old，改为输出 new"""
+    for _ in old:
+        keyboard.send('backspace')
+    await type_result(new)
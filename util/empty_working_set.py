@@ -1,4 +1,13 @@
+import gc
 import ctypes
+import ctypes.util
+from platform import system
+from typing import Tuple
+
+import psutil
+
+# glibc mallopt 的参数号，见 malloc.h
+M_ARENA_MAX = -8
 
 
 def empty_working_set(pid: int):
@@ -15,4 +24,52 @@ def empty_working_set(pid: int):
 def empty_current_working_set():
     # 获取当前进程ID
     pid = ctypes.windll.kernel32.GetCurrentProcessId()
-    empty_working_set(pid)
\ No newline at end of file
+    empty_working_set(pid)
+
+
+def load_libc():
+    """载入 C 库，找不到时返回 None"""
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'))
+    except OSError:
+        return None
+
+
+def limit_malloc_arenas(arenas: int):
+    """
+    限制 glibc 的 malloc arena 数量，须在进程启动推理线程之前调用
+
+    glibc 默认给每个线程最多开 8 × 核数 个 arena，多线程推理后各 arena 里
+    都留着碎片，RSS 会比实际用量高出许多。arenas 为 0 时不限制，非 glibc 系统忽略。
+    """
+    if not arenas or system() != 'Linux':
+        return
+    libc = load_libc()
+    if libc is not None and hasattr(libc, 'mallopt'):
+        libc.mallopt(M_ARENA_MAX, arenas)
+
+
+def current_rss() -> float:
+    """当前进程的常驻内存（MB）"""
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def trim_memory() -> Tuple[float, float]:
+    """
+    把已释放、但仍被分配器留着的内存还给系统，返回前后的 RSS（MB）
+
+    Windows 清空工作集；Linux 调用 glibc 的 malloc_trim；
+    macOS 调用 malloc_zone_pressure_relief。musl 等没有对应函数的系统只做垃圾回收。
+    """
+    before = current_rss()
+    gc.collect()
+    name = system()
+    if name == 'Windows':
+        empty_current_working_set()
+    elif name in ('Linux', 'Darwin'):
+        libc = load_libc()
+        if libc is not None and hasattr(libc, 'malloc_trim'):
+            libc.malloc_trim(0)
+        elif libc is not None and hasattr(libc, 'malloc_zone_pressure_relief'):
+            libc.malloc_zone_pressure_relief(None, 0)
+    return before, current_rss()
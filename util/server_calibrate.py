@@ -0,0 +1,105 @@
+"""
+启动校准：在本机上比较 paraformer 的各个模型文件（如 model.int8.onnx 与 model.onnx）
+和各种线程数，选出识别最快的组合，写入缓存文件
+
+缓存以 CPU 型号、语音模型的线程份额、模型文件大小与修改时间、sherpa-onnx 版本为键，
+这些都不变时，之后的启动直接沿用，不再测。
+
+参考音频用 Config.calibrate_clip 的前 30 秒，为空时用白噪声代替，见 server_sample_audio.py。
+"""
+
+import json
+import time
+import platform
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import ServerConfig as Config
+from config import ModelPaths, ParaformerArgs
+from util.server_cosmic import console
+from util.server_cpu_budget import asr_share
+from util.server_sample_audio import load_clip
+
+CACHE_FILE = ModelPaths.model_dir / 'calibration.json'
+REPEAT = 3              # 每种配置识别几遍，取中位数
+
+
+def fingerprint() -> Dict:
+    """决定校准结果是否还适用的因素"""
+    import sherpa_onnx
+    folder = Path(ParaformerArgs.paraformer).parent
+    return {'cpu': platform.processor() or platform.machine(),
+            'share': asr_share(),
+            'sherpa_onnx': getattr(sherpa_onnx, '__version__', ''),
+            'models': {f.name: [f.stat().st_size, int(f.stat().st_mtime)]
+                       for f in sorted(folder.glob('model*.onnx'))}}
+
+
+def candidates() -> List[Dict]:
+    """待比较的配置：模型文件 × 线程数，线程数不超过每个识别进程的份额"""
+    share = asr_share()
+    threads = sorted({t for t in (1, 2, 4, 6, 8) if t <= share} | {share})
+    models = sorted(Path(ParaformerArgs.paraformer).parent.glob('model*.onnx'))
+    return [{'paraformer': str(model), 'num_threads': t} for model in models for t in threads]
+
+
+def measure(candidate: Dict, samples: np.ndarray) -> Dict:
+    """载入一种配置，识别参考音频，返回实时率（识别耗时 / 音频时长）与时延"""
+    import sherpa_onnx
+    args = {key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
+    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(**{**args, **candidate})
+
+    def decode() -> float:
+        t1 = time.time()
+        stream = recognizer.create_stream()
+        stream.accept_waveform(16000, samples)
+        recognizer.decode_stream(stream)
+        return time.time() - t1
+
+    decode()                                            # 首次识别有额外开销，不计
+    latency = sorted(decode() for _ in range(REPEAT))[REPEAT // 2]
+    return {**candidate, 'latency': latency, 'rtf': latency / (len(samples) / 16000)}
+
+
+def load_cache() -> Optional[Dict]:
+    """读取与本机当前情况相符的校准结果，没有则返回 None"""
+    try:
+        cache = json.loads(CACHE_FILE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    return cache['best'] if cache.get('fingerprint') == fingerprint() else None
+
+
+def calibrate(force: bool = False) -> Dict:
+    """测出最快的配置并写入缓存，缓存仍适用且 force 为 False 时直接返回缓存"""
+    if not force and (best := load_cache()):
+        console.print(f'沿用校准结果：{Path(best["paraformer"]).name}，'
+                      f'{best["num_threads"]} 线程，实时率 {best["rtf"]:.3f}', end='\n\n')
+        return best
+
+    samples = load_clip(Config.calibrate_clip, 30)
+    console.print(f'[yellow]校准中：参考音频 {len(samples) / 16000:.1f}s，'
+                  f'每种配置识别 {REPEAT} 遍取中位数', end='\n\n')
+    results = []
+    for candidate in candidates():
+        result = measure(candidate, samples)
+        results.append(result)
+        console.print(f'    {Path(result["paraformer"]).name}，{result["num_threads"]} 线程：'
+                      f'时延 {result["latency"]:.2f}s，实时率 {result["rtf"]:.3f}')
+
+    best = min(results, key=lambda r: r['latency'])
+    CACHE_FILE.write_text(json.dumps({'fingerprint': fingerprint(), 'best': best, 'results': results},
+                                     ensure_ascii=False, indent=4), encoding='utf-8')
+    console.print(f'[green4]校准完成：{Path(best["paraformer"]).name}，{best["num_threads"]} 线程，'
+                  f'已写入 {CACHE_FILE}', end='\n\n')
+    return best
+
+
+def apply_calibration():
+    """有适用的校准结果时，改用它选出的模型文件和线程数，识别进程启动时调用"""
+    if not Config.calibrate or not (best := load_cache()):
+        return
+    ParaformerArgs.paraformer = best['paraformer']
+    ParaformerArgs.num_threads = best['num_threads']
@@ -1,15 +1,42 @@
 import sys
+import importlib.util
 from pathlib import Path
+from typing import List
 
-
+import config
 from config import ModelPaths
 from util.server_cosmic import console
 
 
+def missing_models(paths) -> List[Path]:
+    """ModelPaths 里不存在的模型文件"""
+    return [Path(path) for key, path in paths.__dict__.items()
+            if not key.startswith('_') and not Path(path).exists()]
+
+
+def reload_model_config() -> List[Path]:
+    """
+    重新读取 config.py，就地更新 ModelPaths 和 ParaformerArgs，返回缺失的模型文件
+
+    有缺失时不做更新。之后启动的识别进程，无论 spawn 还是 fork，都会用上新的配置。
+    ServerConfig 不在此列，调度参数仍需重启服务端才生效。
+    """
+    spec = importlib.util.spec_from_file_location('config_reloaded', config.__file__)
+    fresh = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fresh)
+
+    missing = missing_models(fresh.ModelPaths)
+    if missing:
+        return missing
+    for name in ('ModelPaths', 'ParaformerArgs'):
+        for key, value in getattr(fresh, name).__dict__.items():
+            if not key.startswith('_'):
+                setattr(getattr(config, name), key, value)
+    return []
+
+
 def check_model():
-    for key, path in ModelPaths.__dict__.items() :
-        if key.startswith('_'): continue
-        if path.exists(): continue
+    for path in missing_models(ModelPaths):
         console.print(f'''
     未能找到模型文件 
 
@@ -1,3 +1,6 @@
+REFINE_SUFFIX = ':refine'        # 两遍识别时，第二遍任务的 id 为原任务 id 加上此后缀
+
+
 class Task:
     def __init__(self, source: str,
                  data,
@@ -7,7 +10,11 @@ class Task:
                  socket_id: str,
                  is_final: bool,
                  time_start: float,
-                 time_submit: float) -> None:
+                 time_submit: float,
+                 deadline: float = 0,
+                 model: str = '',
+                 regions: list = None,
+                 seg_duration: float = 0) -> None:
         self.source = source
         self.data = data
         self.offset = offset
@@ -17,6 +24,13 @@ class Task:
         self.is_final = is_final
         self.time_start = time_start
         self.time_submit = time_submit
+        self.time_dispatch = 0          # 出队、交给识别进程的时刻
+        self.deadline = deadline        # 截止时刻，过时的结果对客户端已无用，0 表示不设截止
+        self.skip = ''                  # 非空表示放弃识别，值为原因，识别进程只清理该任务的中间结果
+        self.model = model              # 客户端指定的模型名，为空则按来源选模型
+        self.regions = regions          # 文件按 VAD 切分时，data 由这些语音区间拼成：[(起始秒, 时长秒), ...]
+                                        # 此时 offset 表示本批覆盖到的音频时刻，用于报告进度
+        self.seg_duration = seg_duration  # 该任务的分段长度，与 overlap 一起报告给客户端
         self.samplerate = 16000
 
 
@@ -29,9 +43,15 @@ class Result:
         self.duration = 0               # 全部音频时长
         self.time_start = 0             # 录音开始的时刻
         self.time_submit = 0            # 片段提交时间
+        self.time_dispatch = 0          # 片段出队时间，与提交时间之差即排队时长
         self.time_complete = 0          # 识别完成时间
 
         self.tokens = []                # 字级 token
         self.timestamps = []            # 字级 token 的时间戳
         self.text = ''                  # 合并的文字
         self.is_final = False           # 是否已完成所有片段识别
+        self.skipped = ''               # 非空表示任务被放弃识别，值为原因
+        self.model = ''                 # 识别所用的模型名
+        self.seg_duration = 0           # 服务端为该任务选用的分段长度
+        self.seg_overlap = 0            # 服务端为该任务选用的分段重叠
+        self.is_partial = False         # 流式模型的中间结果，只供显示，最终文字以离线识别为准
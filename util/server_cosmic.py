@@ -1,11 +1,17 @@
 import sys
 from pathlib import Path
-from multiprocessing import Queue
+import multiprocessing
 from typing import Dict, List
 import websockets
 from rich.console import Console 
+from util.server_scheduler import Scheduler
 console = Console(highlight=False)
 
+# 识别进程和模型宿主由扩缩容线程启动，主进程这时还有别的线程，
+# fork 会把它们持有的锁原样复制过去，可能死锁，所以子进程一律用 spawn 启动。
+# 交给子进程的队列也要由它创建，fork 方式创建的队列不能传给 spawn 启动的进程
+spawn_context = multiprocessing.get_context('spawn')
+
 
 
 
@@ -13,5 +19,9 @@ console = Console(highlight=False)
 class Cosmic:
     sockets: Dict[str, websockets.WebSocketClientProtocol] = {}
     sockets_id: List
-    queue_in = Queue()
-    queue_out = Queue()
+    queue_out = spawn_context.Queue()
+    queue_event = spawn_context.Queue()     # 识别进程报告载入完成、空闲等事件，据此派发下一个片段
+    queue_stream = spawn_context.Queue()    # 送给流式识别进程的麦克风音频
+    streamer = None             # 流式识别进程，未开启时为 None
+    scheduler = Scheduler()
+    pool: 'WorkerPool'
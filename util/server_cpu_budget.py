@@ -0,0 +1,64 @@
+import os
+from typing import Dict, List
+
+import psutil
+
+from config import ServerConfig as Config
+from config import ParaformerArgs
+from util.server_cosmic import console
+
+
+def available_cpus() -> List[int]:
+    """本进程可以使用的 CPU 核编号"""
+    try:
+        return sorted(psutil.Process().cpu_affinity())
+    except (AttributeError, psutil.Error):      # macOS 不支持查询亲和性
+        return list(range(os.cpu_count() or 1))
+
+
+def worker_share() -> int:
+    """每个识别进程分到的核数"""
+    cpus = len(available_cpus())
+    return max(min(Config.cpu_budget or cpus, cpus) // Config.max_workers, 1)
+
+
+def asr_share() -> int:
+    """每个识别进程的份额里可以给语音模型的线程数，不计 ParaformerArgs.num_threads 的上限"""
+    per_worker = worker_share()
+    punc = min(Config.punc_threads, per_worker - 1) if Config.format_punc else 0
+    return max(per_worker - punc, 1)
+
+
+def plan_threads(slot: int) -> Dict:
+    """
+    划分 CPU 预算：Config.cpu_budget 个核平均分给 Config.max_workers 个识别进程，
+    每个识别进程再从自己的份额里划出 Config.punc_threads 个给标点模型，其余给语音模型，
+    语音模型的线程数不超过 ParaformerArgs.num_threads
+
+    份额只有 1 个核时，标点模型仍有 1 个线程，与语音模型共用这个核：
+    标点只在最终结果时运行，两者争抢有限，但绑定核后不会借用别的识别进程的核
+
+    slot 为识别进程占用的槽位（0 到 Config.max_workers - 1），同一代识别进程的槽位互不相同，
+    绑定核时按槽位占用各自的一段核
+
+    返回 {'asr': 语音模型线程数, 'punc': 标点模型线程数, 'cpus': 要绑定的核，空列表表示不绑定}
+    """
+    per_worker, share = worker_share(), asr_share()
+
+    pinned = []
+    if Config.pin_cpus:
+        cpus = available_cpus()
+        start = slot * per_worker % len(cpus)
+        pinned = cpus[start:start + per_worker]
+
+    return {'asr': min(ParaformerArgs.num_threads, share), 'punc': max(per_worker - share, 1), 'cpus': pinned}
+
+
+def pin_cpus(cpus: List[int]):
+    """把当前进程绑定到指定的核上，ONNX Runtime 的线程会继承"""
+    if not cpus:
+        return
+    try:
+        psutil.Process().cpu_affinity(cpus)
+    except (AttributeError, psutil.Error) as e:
+        console.print(f'[yellow]无法绑定 CPU 核：{e}')
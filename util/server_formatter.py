@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+from multiprocessing import Queue
+from typing import Callable, Optional
+
+from config import ServerConfig as Config
+from util.server_classes import Result
+from util.server_recognize import punctuate_batch, waits_for_punc
+
+HOLD_POLL = 0.2         # 有结果在等标点模型时，每隔多少秒看一次它是否已载入
+
+
+class Formatter:
+    """
+    识别进程里的格式化线程：最终结果的加标点、转数字、调空格在这里做，
+    识别循环交出最终结果后即可识别下一个片段，两者同时进行
+
+    标点模型还在载入时，文件转录的最终结果先存在线程里等它，最多等到识别完成后 Config.punc_wait 秒，
+    超时或载入失败则按停顿加标点发出；等待期间照常从队列取结果，
+    听写的最终结果不等，立即按停顿加标点发出。
+
+    许多用户同时说完时，最终结果会在队列里排起来。取出一个后再等最多 Config.punc_batch_wait 秒，
+    连同这期间到达的，凑成一批交给标点模型一次推理。
+    """
+
+    def __init__(self, queue_out: Queue, punc_model: Callable[[], Optional[object]],
+                 punc_ready: threading.Event) -> None:
+        self.queue_out = queue_out
+        self.punc_model = punc_model        # 取当前可用的标点模型，未就绪时返回 None
+        self.punc_ready = punc_ready
+        self.queue = queue.Queue()
+        self.seconds = 0.0                  # 累计格式化耗时，即移出识别循环的耗时
+        self.count = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, result: Result):
+        self.queue.put(result)
+
+    def mean(self) -> float:
+        """每个最终结果的平均格式化耗时"""
+        return self.seconds / self.count if self.count else 0.0
+
+    def collect(self, timeout: Optional[float] = None) -> list:
+        """取出一批最终结果，收到退出标记时以 None 结尾，timeout 秒内没有结果时返回空列表"""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + Config.punc_batch_wait
+        while batch[-1] is not None and len(batch) < Config.punc_batch_size:
+            try:
+                batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        held = []       # 在等标点模型的结果
+        while True:
+            timeout = None
+            if held:
+                oldest = min(result.time_complete for result in held)
+                timeout = min(max(oldest + Config.punc_wait - time.time(), 0), HOLD_POLL)
+            batch = self.collect(timeout)
+            stop = bool(batch) and batch[-1] is None
+            batch = [result for result in batch if result is not None]
+
+            # 标点模型已载入、等待超时或要退出时，放出在等的结果；新到的结果中要等的存起来，其余立即发出
+            loaded = self.punc_ready.is_set()
+            released = [result for result in held if loaded or stop or self.expired(result)]
+            held = [result for result in held if result not in released]
+            waiting = [result for result in batch if not loaded and not stop and self.waits(result)]
+            held += waiting
+            self.format([result for result in batch if result not in waiting] + released)
+            if stop:
+                return
+
+    @staticmethod
+    def expired(result: Result) -> bool:
+        return time.time() - result.time_complete >= Config.punc_wait
+
+    def waits(self, result: Result) -> bool:
+        """新到的结果是否要存起来等标点模型"""
+        return not result.skipped and waits_for_punc(result) and not self.expired(result)
+
+    def format(self, batch: list):
+        """调整一批最终结果的格式并发出，被放弃的结果直接发出"""
+        if not batch:
+            return
+        ready = [result for result in batch if not result.skipped]
+        if ready:
+            t1 = time.time()
+            punctuate_batch(ready, self.punc_model())
+            self.seconds += time.time() - t1
+            self.count += len(ready)
+            for result in ready:
+                result.time_complete = time.time()
+        for result in batch:
+            self.queue_out.put(result)
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -1,14 +1,20 @@
+import os
 import time
 import sherpa_onnx
 from multiprocessing import Queue
+from typing import Callable, Optional
 import signal
 import threading # 新增
-from platform import system
 from config import ServerConfig as Config
-from config import ParaformerArgs, ModelPaths
 from util.server_cosmic import console
 from util.server_recognize import recognize
-from util.empty_working_set import empty_current_working_set
+from util.server_formatter import Formatter
+from util.server_cpu_budget import plan_threads, pin_cpus
+from util.server_punc import load_punc_model, warm_up_punc
+from util.server_models import ModelRegistry
+from util.server_calibrate import apply_calibration
+from util import server_timeline as timeline
+from util.empty_working_set import limit_malloc_arenas, trim_memory
 
 # 使用全局变量在进程内共享标点模型和加载状态
 global_punc_model = None
@@ -22,14 +28,18 @@ def disable_jieba_debug():
     import logging
     jieba.setLogLevel(logging.INFO)
 
-def load_punc_model_in_background():
+def load_punc_model_in_background(threads: int):
     """在后台线程中加载标点模型"""
     global global_punc_model
     console.print('[yellow]后台加载标点模型中...[/yellow]')
     try:
         # 将导入移到函数内部，避免在主线程中加载
-        from funasr_onnx import CT_Transformer
-        global_punc_model = CT_Transformer(ModelPaths.punc_model_dir, quantize=True)
+        with timeline.phase('标点模型载入'):
+            punc_model = load_punc_model(threads)
+        if Config.warm_up:
+            with timeline.phase('标点模型预热'):
+                warm_up_punc(punc_model)
+        global_punc_model = punc_model
         console.print(f'[green4]后台标点模型载入完成[/green4]')
     except Exception as e:
         console.print(f'[bold red]后台标点模型加载失败: {e}[/bold red]')
@@ -38,44 +48,106 @@ def load_punc_model_in_background():
         punc_model_loaded.set() # 设置事件，表示加载尝试已完成（无论成功与否）
 
 
-def init_recognizer(queue_in: Queue, queue_out: Queue, sockets_id):
-    global global_punc_model # 声明使用全局变量
+def load_registry(num_threads: int) -> ModelRegistry:
+    """载入各来源默认用的语音模型，其余模型用到时再载入"""
+    registry = ModelRegistry(num_threads)
+    registry.preload()
+    return registry
+
+
+def init_recognizer(worker_id: int, slot: int, queue_in: Queue, queue_out: Queue, queue_event: Queue, sockets_id):
 
     # Ctrl-C 退出
     signal.signal(signal.SIGINT, lambda signum, frame: exit())
+    limit_malloc_arenas(Config.malloc_arena_max)
+    apply_calibration()
+
+    # 划分线程预算，按需绑定 CPU 核
+    threads = plan_threads(slot)
+    pin_cpus(threads['cpus'])
+    console.print(f'识别进程 {worker_id} 线程预算：语音模型 {threads["asr"]}，'
+                  f'标点模型 {threads["punc"]}，绑定核 {threads["cpus"] or "不绑定"}', end='\n\n')
 
     # 导入核心模块
-    with console.status("载入核心模块中…", spinner="bouncingBall", spinner_style="yellow"):
+    with console.status("载入核心模块中…", spinner="bouncingBall", spinner_style="yellow"), timeline.phase('导入模块'):
         import sherpa_onnx
         # funasr_onnx 的导入移到后台加载函数中
         disable_jieba_debug()
     console.print('[green4]核心模块加载完成', end='\n\n')
 
-    # 载入语音模型
+    # 载入语音模型和标点模型，空闲释放后也用它重新载入
+    def load_models():
+        # 先启动后台线程加载标点模型，与语音模型同时载入
+        if Config.format_punc:
+            punc_loader_thread = threading.Thread(target=load_punc_model_in_background,
+                                                  args=(threads['punc'],), daemon=True)
+            punc_loader_thread.start()
+        else:
+            # 如果配置中不启用标点，则直接标记为已加载
+            punc_model_loaded.set()
+        return load_registry(threads['asr'])
+
     console.print('[yellow]语音模型载入中', end='\r'); t1 = time.time()
-    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(
-        **{key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
-    )
+    registry = load_models()
     console.print(f'[green4]语音模型载入完成', end='\n\n')
-
-    # 启动后台线程加载标点模型
     if Config.format_punc:
-        punc_loader_thread = threading.Thread(target=load_punc_model_in_background, daemon=True)
-        punc_loader_thread.start()
         console.print('[cyan]标点模型已在后台开始加载，服务器可以开始接收任务。[/cyan]', end='\n\n')
-    else:
-        # 如果配置中不启用标点，则直接标记为已加载
-        punc_model_loaded.set()
 
     console.print(f'语音模型加载耗时 {time.time() - t1 :.2f}s', end='\n\n')
 
-    # 清空物理内存工作集
-    if system() == 'Windows':
-        empty_current_working_set()
+    # 载入模型时的临时内存还给系统
+    queue_event.put((worker_id, 'trimmed', trim_memory()))
+
+    serve(worker_id, registry, queue_in, queue_out, queue_event, sockets_id, load_models)
+
+
+def unload_models():
+    """释放标点模型，语音模型由调用方丢弃引用，返回释放前后的 RSS（MB）"""
+    global global_punc_model
+    if punc_model_loaded.is_set():              # 正在后台载入时不动它
+        global_punc_model = None
+        punc_model_loaded.clear()
+    return trim_memory()
+
+
+def serve(worker_id: int, registry: Optional[ModelRegistry], queue_in: Queue, queue_out: Queue, queue_event: Queue, sockets_id,
+          load_models: Optional[Callable] = None):
+    """
+    识别循环：向主进程报告空闲，取片段、识别、返回结果
 
-    queue_out.put(True)  # 通知主进程，核心服务已就绪
+    除了片段，主进程还会发来指令：
+        'unload'：长时间空闲，释放模型
+        'load'  ：有客户端连接，提前重新载入模型
+    释放后若直接收到片段，也会先重新载入。load_models 为 None 时（预派生模式）不释放。
+
+    每个片段用哪个模型识别，由 registry 按任务指定的模型名或来源决定。
+
+    记录每次（重新）载入后首个片段与之后各片段的实时率，报告给主进程，以检验预热的效果，
+    一并报告最终结果的平均格式化耗时，即交给格式化线程、移出识别循环的耗时。
+
+    最终结果交给格式化线程加标点后发出，标点模型在后台载入，载入完成时报告 punc_ready；
+    载入前听写结果按停顿加标点立即发出，文件转录结果在格式化线程里等它，见 server_formatter.py。
+    """
+
+    # 通知主进程，核心服务已就绪，可以派发片段了
+    queue_event.put((worker_id, 'timeline', timeline.flush()))
+    queue_event.put((worker_id, 'loaded', os.getpid()))
+    queue_event.put((worker_id, 'ready', None))
+    latency = {'first': 0.0, 'steady': 0.0, 'count': 0}    # 实时率：首个片段、之后各片段的平均
+    punc_reported = False           # 是否已报告标点模型就绪
+    formatter = Formatter(queue_out, lambda: global_punc_model if punc_model_loaded.is_set() else None,
+                          punc_model_loaded)
 
     while True:
+        # 报告后台载入的标点模型等新记录的启动阶段
+        if phases := timeline.flush():
+            queue_event.put((worker_id, 'timeline', phases))
+
+        # 报告标点模型就绪
+        if punc_model_loaded.is_set() and not punc_reported:
+            punc_reported = True
+            queue_event.put((worker_id, 'punc_ready', global_punc_model is not None))
+
         # 从队列中获取任务消息
         # 阻塞最多1秒，便于中断退出
         try:
@@ -83,11 +155,57 @@ def init_recognizer(queue_in: Queue, queue_out: Queue, sockets_id):
         except:
             continue
 
-        if task.socket_id not in sockets_id:    # 检查任务所属的连接是否存活
+        if task is None:                        # 主进程让本进程退役
+            formatter.stop()                    # 先发出还在格式化的最终结果
+            break
+
+        if task == 'unload':
+            if registry is not None and load_models is not None:
+                registry.clear()
+                registry = None
+                queue_event.put((worker_id, 'trimmed', unload_models()))
+                queue_event.put((worker_id, 'unloaded', None))
+                punc_reported = False
             continue
 
-        # 在执行识别前，获取当前可用的 punc_model
-        current_punc_model = global_punc_model if punc_model_loaded.is_set() else None
-        
-        result = recognize(recognizer, current_punc_model, task)   # 执行识别
-        queue_out.put(result)      # 返回结果
+        if registry is None:                    # 已释放，重新载入并记录冷启动耗时
+            t1 = time.time()
+            registry = load_models()
+            queue_event.put((worker_id, 'reloaded', time.time() - t1))
+            latency = {'first': 0.0, 'steady': 0.0, 'count': 0}
+
+        if task == 'load':
+            continue
+
+        if task.socket_id not in sockets_id:    # 检查任务所属的连接是否存活
+            if not task.is_final:
+                queue_event.put((worker_id, 'ready', None))
+                continue
+            task.skip = task.skip or 'disconnected'   # 最终片段仍要交给 recognize，以清理中间结果
+
+        # 被放弃的片段只清理中间结果，不必为它载入模型
+        model = registry.route(task)
+        recognizer = None if task.skip else registry.get(model)
+
+        t1 = time.time()
+        result = recognize(recognizer, task)   # 执行识别
+        result.model = model
+        queue_event.put((worker_id, 'ready', None))     # 识别完成即可派发下一个片段
+        if result.is_final:
+            formatter.put(result)      # 交给格式化线程，调整格式后返回
+        else:
+            queue_out.put(result)      # 返回结果
+
+        # 记录实时率
+        if not task.skip and task.data:
+            rtf = (time.time() - t1) / (len(task.data) / 4 / task.samplerate)
+            if latency['count'] == 0:
+                latency['first'] = rtf
+            else:
+                latency['steady'] += (rtf - latency['steady']) / latency['count']
+            latency['count'] += 1
+            queue_event.put((worker_id, 'latency', {**latency, 'format': formatter.mean()}))
+
+        # 长音频识别完，中间结果和缓存都已释放，把空闲内存还给系统
+        if result.is_final and result.duration > Config.trim_after:
+            queue_event.put((worker_id, 'trimmed', trim_memory()))
@@ -0,0 +1,48 @@
+"""
+相邻片段重叠部分的合并
+
+有重叠的片段，重叠窗口里的字两个片段都识别了一遍。
+在窗口里找两边 token 序列最长的相同连续段，时间戳也须对得上，
+先前结果保留到相同段的末尾，新片段从相同段之后接上。
+找不到相同段时（如重叠里没有说话），退回按时间戳在窗口中点切开。
+"""
+
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple
+
+TOLERANCE = 0.2     # 两个片段对同一个字给出的时间戳，最多相差多少秒仍算对得上
+
+
+def align(prev_tokens: List[str], prev_times: List[float],
+          tokens: List[str], times: List[float],
+          offset: float, overlap: float) -> Tuple[int, int]:
+    """
+    合并新片段的识别结果
+
+    prev_tokens、prev_times 为先前的结果，时间戳从音频开头算；
+    tokens、times 为新片段的结果，时间戳从片段开头算，片段从 offset 秒开始，
+    开头 overlap 秒与上一个片段重叠。
+
+    返回 (k, m)：先前结果保留前 k 个 token，新片段从第 m 个 token 接上
+    """
+    start = bisect_left(prev_times, offset - TOLERANCE)
+    end = bisect_right(times, overlap + TOLERANCE)
+    center = offset + overlap / 2
+
+    # 最长相同连续段，run[j] 为以先前第 i 个、新片段第 j 个 token 结尾的相同段长度
+    best, best_key = None, None
+    run = [0] * (end + 1)
+    for i in range(start, len(prev_tokens)):
+        for j in reversed(range(end)):
+            if prev_tokens[i] == tokens[j] and abs(prev_times[i] - times[j] - offset) <= TOLERANCE:
+                run[j + 1] = run[j] + 1
+                # 一样长时，取离窗口中点近的，那里两个片段都有足够的上下文
+                key = (run[j + 1], -abs(prev_times[i] - center))
+                if best_key is None or key > best_key:
+                    best, best_key = (i + 1, j + 1), key
+            else:
+                run[j + 1] = 0
+    if best:
+        return best
+
+    return bisect_right(prev_times, center), bisect_right(times, overlap / 2)
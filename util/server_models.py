@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+from typing import Dict
+
+import numpy as np
+
+from config import ServerConfig as Config
+from config import ParaformerArgs
+from util.server_cosmic import console
+from util.server_classes import Task
+from util.empty_working_set import current_rss, trim_memory
+from util import server_timeline as timeline
+
+DEFAULT_MODEL = 'paraformer'
+WARM_UP_SECONDS = (3, 17)       # 预热用的音频时长：一句短听写、一个完整的麦克风片段
+
+# 模型种类 -> sherpa-onnx 的构造方法
+FACTORIES = {
+    'paraformer': 'from_paraformer',
+    'transducer': 'from_transducer',
+    'wenet_ctc': 'from_wenet_ctc',
+    'whisper': 'from_whisper',
+}
+
+
+def model_specs() -> Dict[str, Dict]:
+    """全部可用模型的构造参数：内置的 paraformer，加上 Config.models 里登记的"""
+    specs = {DEFAULT_MODEL: {'kind': 'paraformer',
+                             **{key: value for key, value in ParaformerArgs.__dict__.items()
+                                if not key.startswith('_')}}}
+    specs.update(Config.models)
+    return specs
+
+
+def create_recognizer(spec: Dict, num_threads: int):
+    """按构造参数创建识别器，线程数由调用方的线程预算决定"""
+    import sherpa_onnx
+    factory = getattr(sherpa_onnx.OfflineRecognizer, FACTORIES[spec['kind']])
+    args = {key: value for key, value in spec.items() if key != 'kind'}
+    return factory(**{**args, 'num_threads': num_threads})
+
+
+def warm_up(recognizer):
+    """
+    识别几段微弱的噪声，让 ONNX Runtime 按常见的片段长度分配好内存、选好算子实现，
+    首个真实请求就不必再付这笔开销
+    """
+    rng = np.random.default_rng(0)
+    for seconds in WARM_UP_SECONDS:
+        samples = (rng.standard_normal(16000 * seconds) * 0.01).astype(np.float32)
+        stream = recognizer.create_stream()
+        stream.accept_waveform(16000, samples)
+        recognizer.decode_stream(stream)
+
+
+class ModelRegistry:
+    """
+    识别进程内的模型登记表
+
+    任务按客户端指定的模型名、或按来源查 Config.model_routes 选模型，
+    都没有时用内置的 paraformer。模型用到时才载入，
+    常驻模型的内存合计超过 Config.model_memory 时，释放最久没用的模型。
+    每个模型的内存按载入前后的 RSS 之差估算。
+    """
+
+    def __init__(self, num_threads: int) -> None:
+        self.num_threads = num_threads
+        self.models: OrderedDict = OrderedDict()    # 名字 -> 识别器，按最近使用排序
+        self.sizes: Dict[str, float] = {}           # 名字 -> 估算内存（MB）
+        self.failed = set()                         # 载入失败的模型，不再尝试
+
+    def route(self, task: Task) -> str:
+        """选出识别该片段的模型名"""
+        specs = model_specs()
+        for name in (task.model, Config.model_routes.get(task.source, DEFAULT_MODEL)):
+            if name in specs and name not in self.failed:
+                return name
+        return DEFAULT_MODEL
+
+    def get(self, name: str):
+        """取出模型，没有载入的先载入"""
+        if name in self.models:
+            self.models.move_to_end(name)
+            return self.models[name]
+
+        t1, before = time.time(), current_rss()
+        try:
+            with timeline.phase(f'{name} 载入'):
+                recognizer = create_recognizer(model_specs()[name], self.num_threads)
+        except Exception as e:
+            if name == DEFAULT_MODEL:
+                raise
+            console.print(f'模型 {name} 载入失败，改用 {DEFAULT_MODEL}：{e}', style='bright_red')
+            self.failed.add(name)
+            return self.get(DEFAULT_MODEL)
+
+        console.print(f'模型 {name} 载入完成，耗时 {time.time() - t1:.2f}s', style='green4')
+        if Config.warm_up:
+            t1 = time.time()
+            with timeline.phase(f'{name} 预热'):
+                warm_up(recognizer)
+            console.print(f'模型 {name} 预热完成，耗时 {time.time() - t1:.2f}s', style='green4')
+
+        # 内存估算包括预热时分配的推理缓存
+        self.models[name] = recognizer
+        self.sizes[name] = max(current_rss() - before, 0.0)
+        console.print(f'模型 {name} 约占内存 {self.sizes[name]:.0f}MB', style='bright_black')
+        self.evict()
+        return recognizer
+
+    def evict(self):
+        """超出内存上限时，释放最久没用的模型，至少保留刚用过的一个"""
+        evicted = False
+        while len(self.models) > 1 and sum(self.sizes.values()) > Config.model_memory * 1024:
+            name, _ = self.models.popitem(last=False)
+            console.print(f'模型常驻内存超出 {Config.model_memory}GB，释放最久没用的模型 {name}', style='yellow')
+            self.sizes.pop(name)
+            evicted = True
+        if evicted:
+            trim_memory()
+
+    def preload(self):
+        """预先载入各来源默认用的模型、两遍识别的准确模型，免得首个任务等待载入"""
+        names = [Config.model_routes.get(source, DEFAULT_MODEL) for source in ('mic', 'file')]
+        for name in names + ([Config.mic_refine] if Config.mic_refine else []):
+            self.get(name if name in model_specs() else DEFAULT_MODEL)
+
+    def clear(self):
+        self.models.clear()
+        self.sizes.clear()
@@ -0,0 +1,68 @@
+import os
+import queue
+import signal
+import multiprocessing
+from multiprocessing import Queue
+from typing import List
+
+from config import ServerConfig as Config
+from util.server_cosmic import console
+from util.server_cpu_budget import plan_threads, pin_cpus
+from util.empty_working_set import limit_malloc_arenas, trim_memory
+from util.server_calibrate import apply_calibration
+from util.server_init_recognizer import (load_registry, load_punc_model_in_background,
+                                         disable_jieba_debug, punc_model_loaded, serve)
+
+
+def init_model_host(commands: Queue, slots: List[Queue], queue_out: Queue, queue_event: Queue, sockets_id):
+    """
+    预派生模式的模型宿主进程：只载入一次模型，再按主进程的指令 fork 出识别进程
+
+    fork 出的识别进程与宿主共享模型权重所在的只读内存页，
+    每个识别进程实际多占用的只有推理时各自分配的缓存，可以用 PSS 验证。
+
+    ONNX Runtime 的线程池在 fork 之后不可用，所以宿主以单线程载入模型、
+    也不启动任何后台线程，识别进程各自单线程推理，并行度靠多开识别进程获得。
+
+    指令为 (识别进程 id, 槽位)，识别进程从 slots[槽位] 取片段；指令为 None 时退出。
+    """
+
+    # Ctrl-C 退出
+    signal.signal(signal.SIGINT, lambda signum, frame: exit())
+    parent = os.getppid()
+    limit_malloc_arenas(Config.malloc_arena_max)
+    apply_calibration()
+
+    console.print('[yellow]预派生模式：模型宿主载入模型中...', end='\n\n')
+    disable_jieba_debug()
+    registry = load_registry(1)
+    if Config.format_punc:
+        load_punc_model_in_background(1)        # 在本线程同步载入
+    else:
+        punc_model_loaded.set()
+    before, after = trim_memory()       # fork 之前把载入时的临时内存还给系统，子进程就不会继承这部分
+    console.print(f'[green4]预派生模式：模型宿主载入完成，RSS {before:.0f}MB → {after:.0f}MB', end='\n\n')
+
+    fork = multiprocessing.get_context('fork')
+    while True:
+        try:
+            command = commands.get(timeout=1)
+        except queue.Empty:
+            multiprocessing.active_children()   # 回收已退役的识别进程
+            if os.getppid() != parent:          # 主进程已退出
+                break
+            continue
+
+        if command is None:
+            break
+
+        worker_id, slot = command
+        fork.Process(target=serve_forked,
+                     args=(worker_id, slot, registry, slots[slot], queue_out, queue_event, sockets_id),
+                     daemon=True).start()
+
+
+def serve_forked(worker_id: int, slot: int, registry, queue_in: Queue, queue_out: Queue, queue_event: Queue, sockets_id):
+    """fork 出的识别进程，直接使用宿主载入好的模型"""
+    pin_cpus(plan_threads(slot)['cpus'])
+    serve(worker_id, registry, queue_in, queue_out, queue_event, sockets_id)
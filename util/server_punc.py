@@ -0,0 +1,213 @@
+import os
+import hashlib
+import platform
+import threading
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from config import ServerConfig as Config
+from config import ModelPaths
+
+CACHE_DIR = ModelPaths.model_dir / 'ort_cache'
+
+
+def session_options(threads: int):
+    """标点模型的 ONNX Runtime 会话参数：线程数与自旋策略"""
+    from onnxruntime import SessionOptions, GraphOptimizationLevel
+
+    spinning = '1' if Config.ort_spinning else '0'
+    sess_opt = SessionOptions()
+    sess_opt.intra_op_num_threads = threads
+    sess_opt.inter_op_num_threads = 1           # 标点模型是顺序图，算子间并行没有收益
+    sess_opt.log_severity_level = 4
+    sess_opt.enable_cpu_mem_arena = False
+    sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_opt.add_session_config_entry('session.intra_op.allow_spinning', spinning)
+    sess_opt.add_session_config_entry('session.inter_op.allow_spinning', spinning)
+    return sess_opt
+
+
+def cached_model_path(model_file: str, threads: int) -> Path:
+    """
+    优化后的计算图的缓存位置，以模型文件哈希、ONNX Runtime 版本、线程数、CPU 为键
+
+    ORT_ENABLE_ALL 级别的优化会用上与硬件相关的算子，所以换了 CPU 也要重新优化
+    """
+    import onnxruntime
+    digest = hashlib.sha256()
+    with open(model_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    key = '|'.join([digest.hexdigest(), onnxruntime.__version__, str(threads),
+                    platform.processor() or platform.machine()])
+    return CACHE_DIR / f'{Path(model_file).stem}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.onnx'
+
+
+def create_session(model_file: str, threads: int):
+    """
+    创建推理会话，优化后的计算图缓存到磁盘，之后的启动直接载入，跳过图优化
+
+    缓存先写到临时文件再改名，多个识别进程同时启动也不会读到写了一半的文件
+    """
+    from onnxruntime import InferenceSession, GraphOptimizationLevel
+
+    if not Config.ort_cache:
+        return InferenceSession(model_file, sess_options=session_options(threads),
+                                providers=['CPUExecutionProvider'])
+
+    cached = cached_model_path(model_file, threads)
+    if cached.exists():
+        sess_opt = session_options(threads)
+        sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return InferenceSession(str(cached), sess_options=sess_opt, providers=['CPUExecutionProvider'])
+        except Exception:
+            cached.unlink(missing_ok=True)      # 缓存损坏，重新优化
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    temp = cached.with_suffix(f'.{os.getpid()}.tmp')
+    sess_opt = session_options(threads)
+    sess_opt.optimized_model_filepath = str(temp)
+    session = InferenceSession(model_file, sess_options=sess_opt, providers=['CPUExecutionProvider'])
+    if temp.exists():
+        os.replace(temp, cached)
+    return session
+
+
+def load_punc_model(threads: int):
+    """
+    载入标点模型
+
+    funasr_onnx 的 CT_Transformer 只开放了 intra_op_num_threads，
+    所以构造时临时换入自己的 OrtInferSession，用 session_options 创建会话
+    """
+    from funasr_onnx import punc_bin
+
+    class OrtInferSession(punc_bin.OrtInferSession):
+        def __init__(self, model_file, device_id=-1, intra_op_num_threads=4):
+            self.session = create_session(model_file, threads)
+
+    original = punc_bin.OrtInferSession
+    punc_bin.OrtInferSession = OrtInferSession
+    try:
+        return punc_bin.CT_Transformer(ModelPaths.punc_model_dir, quantize=True)
+    finally:
+        punc_bin.OrtInferSession = original
+
+
+def warm_up_punc(punc_model):
+    """先跑一句话，让 ONNX Runtime 分配好内存、选好算子实现"""
+    punc_model('今天天气不错我们一起去公园散步吧 hello world')
+
+
+def punctuate_texts(punc_model, texts: List[str]) -> List[str]:
+    """
+    给多段文字加标点，各段的推理合成一批，一次调用 ONNX Runtime
+
+    CT_Transformer 把长文字切成小句逐句推理，还要根据上一句的结果决定下一句从哪里开始，
+    这些逻辑原样保留：每段文字在自己的线程里调用模型，模型的 infer 临时换成排队函数，
+    等各线程都交来了输入（或已完成），把它们补齐到同一长度合成一批推理，再把结果分回去。
+    模型不支持批量推理的话，改回逐个推理，之后也不再尝试。
+    """
+    if len(texts) < 2 or getattr(punc_model, 'batch_failed', False):
+        return [punc_model(text)[0] for text in texts]
+
+    infer = punc_model.infer
+    cond = threading.Condition()
+    pending = []                    # 等待推理的 [输入, 长度, 输出]
+    active = [len(texts)]           # 还没完成的文字段数
+    outputs = list(texts)           # 推理出错的段保持原样
+
+    def queued_infer(feats, feats_len):
+        request = [feats, feats_len, None]
+        with cond:
+            pending.append(request)
+            cond.notify_all()
+            cond.wait_for(lambda: request[2] is not None)
+        if isinstance(request[2], Exception):
+            raise request[2]
+        return request[2]
+
+    def run(index):
+        try:
+            outputs[index] = punc_model(texts[index])[0]
+        except Exception:
+            pass
+        finally:
+            with cond:
+                active[0] -= 1
+                cond.notify_all()
+
+    punc_model.infer = queued_infer
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(len(texts))]
+    try:
+        for thread in threads:
+            thread.start()
+        while True:
+            with cond:
+                cond.wait_for(lambda: len(pending) == active[0])
+                if not active[0]:
+                    break
+                batch = pending[:]
+                pending.clear()
+            try:
+                results = infer_batch(punc_model, infer, batch)
+            except Exception as e:
+                results = [e] * len(batch)
+            with cond:
+                for request, result in zip(batch, results):
+                    request[2] = result
+                cond.notify_all()
+    finally:
+        del punc_model.infer            # 恢复类上的 infer
+        for thread in threads:
+            thread.join()
+    return outputs
+
+
+def infer_batch(punc_model, infer, batch) -> List:
+    """把几段小句补齐到同一长度一起推理，返回各自的输出"""
+    lengths = [int(feats_len[0]) for _, feats_len, _ in batch]
+    if len(batch) > 1 and not getattr(punc_model, 'batch_failed', False):
+        feats = np.zeros((len(batch), max(lengths)), dtype=batch[0][0].dtype)
+        for i, (request, length) in enumerate(zip(batch, lengths)):
+            feats[i, :length] = request[0][0]
+        try:
+            y = infer(feats, np.array(lengths, dtype=batch[0][1].dtype))[0]
+            return [[y[i:i + 1, :length]] for i, length in enumerate(lengths)]
+        except Exception:
+            punc_model.batch_failed = True
+    return [infer(feats, feats_len) for feats, feats_len, _ in batch]
+
+
+
+def pause_punctuate(tokens: List[str], timestamps: List[float]) -> List[str]:
+    """
+    按停顿加标点：字与字之间停顿长的加逗号，更长的加句号，末尾加句号
+
+    时间戳是各字的起始时刻，两字间隔包含了前一个字本身的时长，
+    所以阈值取固定秒数与本句字间隔中位数倍数中的较大者，适应不同语速。
+    只需遍历一遍，标点模型载入前、或听写要求低延迟时使用。
+    """
+    if not tokens:
+        return tokens
+    gaps = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    median = sorted(gaps)[len(gaps) // 2] if gaps else 0.0
+    comma = max(Config.pause_comma, median * 2.5)
+    period = max(Config.pause_period, median * 4)
+
+    result = []
+    for token, gap in zip(tokens, gaps + [None]):
+        if gap is None:
+            mark = '。'
+        elif gap > period:
+            mark = '。'
+        elif gap > comma:
+            mark = '，'
+        else:
+            mark = ''
+        # 英文子词以 @@ 结尾，与下一个子词拼成一个词，中间不能插标点
+        result.append(token if token.endswith('@@') else token + mark)
+    return result
@@ -8,6 +8,8 @@ from config import ServerConfig as Config
 from util.server_classes import Task, Result
 from util.chinese_itn import chinese_to_num
 from util.format_tools import adjust_space
+from util.server_punc import pause_punctuate, punctuate_texts
+from util.server_merge import align
 from rich import inspect
 
 
@@ -31,7 +33,65 @@ def format_text(text, punc_model):
     return text
 
 
-def recognize(recognizer, punc_model, task: Task):
+def join_tokens(tokens) -> str:
+    """token 合并为文本"""
+    text = ' '.join(tokens).replace('@@ ', '')
+    return re.sub('([^a-zA-Z0-9]) (?![a-zA-Z0-9])', r'\1', text)
+
+
+def pause_punc(result: Result, punc_model) -> bool:
+    """标点模型还没载入、或麦克风结果要求低延迟（Config.mic_punc 为 'pause'）时，按停顿加标点"""
+    pause = punc_model is None or (result.source == 'mic' and Config.mic_punc == 'pause')
+    return Config.format_punc and pause
+
+
+def waits_for_punc(result: Result) -> bool:
+    """标点模型还在载入时，最终结果是否等它：听写结果要在时延预算内打出，直接按停顿加标点；文件转录等得起"""
+    return bool(Config.format_punc and Config.punc_wait) and result.source != 'mic'
+
+
+def format_final(result: Result, punc_model) -> str:
+    """最终结果的文本：有标点模型就用它加标点，否则按停顿加标点"""
+    if pause_punc(result, punc_model):
+        return format_text(join_tokens(pause_punctuate(result.tokens, result.timestamps)), None)
+    return format_text(join_tokens(result.tokens), punc_model)
+
+
+def punctuate(result: Result, punc_model) -> Result:
+    """最终结果从 token 重新生成文本，加上标点、转换数字、调整空格"""
+    result.text = format_final(result, punc_model)
+    return result
+
+
+def punctuate_batch(batch, punc_model):
+    """
+    一批最终结果一起调整格式，与 punctuate 的结果相同，
+    只是要用标点模型的那些，合成一批推理
+    """
+    modeled = []
+    for result in batch:
+        if result.skipped:
+            continue
+        if Config.format_punc and punc_model and not pause_punc(result, punc_model):
+            modeled.append(result)
+        else:
+            punctuate(result, punc_model)
+
+    texts = [join_tokens(result.tokens) for result in modeled]
+    if Config.format_spell:
+        texts = [adjust_space(text) for text in texts]
+    indexes = [i for i, text in enumerate(texts) if text]
+    for i, text in zip(indexes, punctuate_texts(punc_model, [texts[i] for i in indexes])):
+        texts[i] = text
+    for result, text in zip(modeled, texts):
+        if Config.format_num:
+            text = chinese_to_num(text)
+        if Config.format_spell:
+            text = adjust_space(text)
+        result.text = text
+
+
+def recognize(recognizer, task: Task):
 
     # inspect({key:value for key, value in task.__dict__.items() if not key.startswith('_') and key != 'data'})
     # todo 清空遗存的任务结果
@@ -43,6 +103,22 @@ def recognize(recognizer, punc_model, task: Task):
     # 取出结果容器
     result = results[task.task_id]
 
+    # 被放弃的任务，不再识别，只清理中间结果
+    if task.skip:
+        result = results.pop(task.task_id)
+        result.time_start = task.time_start
+        result.time_submit = task.time_submit
+        result.time_dispatch = task.time_dispatch
+        result.time_complete = time.time()
+        result.is_final = True
+        result.skipped = task.skip
+        return result
+
+    # 文件按 VAD 切出的语音区间成批识别
+    if task.regions is not None:
+        decode_regions(recognizer, task, result)
+        return finish(result, task)
+
     # 片段预处理
     samples = np.frombuffer(task.data, dtype=np.float32)
     duration = len(samples) / task.samplerate
@@ -55,48 +131,64 @@ def recognize(recognizer, punc_model, task: Task):
     stream.accept_waveform(task.samplerate, samples)
     recognizer.decode_stream(stream)
 
-    # 记录识别时间
-    result.time_start = task.time_start
-    result.time_submit = task.time_submit
-    result.time_complete = time.time()
-
-    # 先粗去重，依据：字级时间戳
-    m = n = len(stream.result.timestamps)
-    for i, timestamp in enumerate(stream.result.timestamps, start=0):
-        if timestamp > task.overlap / 2: 
-            m = i
-            break
-    for i, timestamp in enumerate(stream.result.timestamps, start=1):
-        n = i
-        if timestamp > duration - task.overlap / 2:
-            break
-    if not result.timestamps:
-        m = 0
-    if task.is_final:
-        n = len(stream.result.timestamps)
+    # whisper 等模型不给字级时间戳，整段文字当作位于片段中点的一个 token，重叠部分无法去重
+    tokens, timestamps = stream.result.tokens, stream.result.timestamps
+    if not timestamps and stream.result.text:
+        tokens, timestamps = [stream.result.text], [duration / 2]
 
-    # 再细去重，依据：在端点是否有重复的字
-    if result.tokens and result.tokens[-2:] == stream.result.tokens[m:n][:2]:
-        m += 2
-    elif result.tokens and result.tokens[-1:] == stream.result.tokens[m:n][:1]:
-        m += 1
+    # 有重叠的片段，按重叠窗口里的 token 序列对齐去重；在停顿处切分的片段没有重叠，直接接上
+    m = 0
+    if task.overlap and result.tokens:
+        k, m = align(result.tokens, result.timestamps, tokens, timestamps, task.offset, task.overlap)
+        del result.tokens[k:], result.timestamps[k:]
 
     # 最后与先前的结果合并
-    result.timestamps += [t + task.offset for t in stream.result.timestamps[m:n]]
-    result.tokens += [token for token in stream.result.tokens[m:n]]
+    result.timestamps += [t + task.offset for t in timestamps[m:]]
+    result.tokens += tokens[m:]
 
-    # token 合并为文本
-    text = ' '.join(result.tokens).replace('@@ ', '')
-    text = re.sub('([^a-zA-Z0-9]) (?![a-zA-Z0-9])', r'\1', text)
+    return finish(result, task)
 
-    result.text = text
+
+def decode_regions(recognizer, task: Task, result: Result):
+    """
+    一批语音区间各建一个 stream，一次 decode_streams 识别完，
+    时间戳加上各区间在音频中的起始时刻。区间互不重叠，不用去重
+    """
+    samples = np.frombuffer(task.data, dtype=np.float32)
+    streams, position = [], 0
+    for start, length in task.regions:
+        size = round(length * task.samplerate)
+        stream = recognizer.create_stream()
+        stream.accept_waveform(task.samplerate, samples[position:position + size])
+        streams.append(stream)
+        position += size
+    if streams:
+        recognizer.decode_streams(streams)
+
+    for (start, length), stream in zip(task.regions, streams):
+        tokens, timestamps = stream.result.tokens, stream.result.timestamps
+        if not timestamps and stream.result.text:
+            tokens, timestamps = [stream.result.text], [length / 2]
+        result.tokens += tokens
+        result.timestamps += [t + start for t in timestamps]
+    result.duration = task.offset       # 区间批次的 offset 是本批覆盖到的音频时刻
+
+
+def finish(result: Result, task: Task) -> Result:
+    """记录识别时间、合并文本，最后一个片段还要摘取任务，其格式由识别进程的格式化线程调整"""
+    result.time_start = task.time_start
+    result.time_submit = task.time_submit
+    result.time_dispatch = task.time_dispatch
+    result.time_complete = time.time()
+    result.seg_duration = task.seg_duration
+    result.seg_overlap = task.overlap
+
+    # token 合并为文本
+    result.text = join_tokens(result.tokens)
 
     if not task.is_final:
         return result
 
-    # 调整文本格式
-    result.text = format_text(text, punc_model)
-
     # 若最后一个片段完成识别，从字典摘取任务
     result = results.pop(task.task_id)
     result.is_final = True
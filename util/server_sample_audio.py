@@ -0,0 +1,22 @@
+"""
+测试与校准用的参考音频
+
+不给音频文件时用白噪声代替：paraformer 是非自回归模型，识别耗时主要取决于音频长度，
+用噪声测出的相对快慢也有参考意义，只是识别结果为空。
+"""
+
+import subprocess
+
+import numpy as np
+
+NOISE_SECONDS = 15      # 白噪声的时长
+
+
+def load_clip(file: str = '', limit: float = 0) -> np.ndarray:
+    """读取音频为 16000 采样率、单声道的 float32 数组，只取前 limit 秒，0 表示不截取；file 为空时返回白噪声"""
+    if not file:
+        return (np.random.default_rng(0).standard_normal(16000 * NOISE_SECONDS) * 0.1).astype(np.float32)
+    ffmpeg_cmd = ["ffmpeg", "-i", file, "-f", "f32le", "-ac", "1", "-ar", "16000", "-"]
+    data = subprocess.run(ffmpeg_cmd, capture_output=True).stdout
+    samples = np.frombuffer(data, dtype=np.float32)
+    return samples[:int(16000 * limit)] if limit else samples
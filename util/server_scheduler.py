@@ -0,0 +1,288 @@
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from config import ServerConfig as Config
+from util.server_classes import Task
+
+
+class ClientShare:
+    """一个客户端（socket）在调度器里的份额记账"""
+    def __init__(self, addr: str, weight: float) -> None:
+        self.addr = addr            # 客户端地址
+        self.weight = weight        # 调度权重，越大分到的识别时间越多
+        self.queued = 0.0           # 排队中的音频秒数
+        self.served = 0.0           # 已派发识别的音频秒数
+        self.vtime = 0.0            # 虚拟时间：served / weight，越小越优先
+
+
+class Scheduler:
+    """
+    带优先级的任务队列，取代原先 FIFO 的 queue_in
+
+    优先级：麦克风最终片段 > 麦克风片段 > 文件片段
+    同一任务的片段必须按顺序识别，所以按任务分组排队，
+    任务的优先级取其排队片段中最高的那个。
+    文件片段排队超过 Config.file_max_wait 秒后，提升到麦克风片段的优先级，防止饿死。
+
+    同一优先级内按加权公平份额轮转：先服务虚拟时间最小的客户端，
+    同一客户端的多个任务之间，再先服务已识别时长最少的任务。
+
+    麦克风任务过了截止时刻、或被客户端取消，就放弃识别：丢弃其排队片段，
+    若识别进程里已有它的中间结果，再派发一个带 skip 标记的空片段去清理。
+
+    识别进程可以有多个。任务的中间结果保存在识别进程里，所以任务一旦开始识别，
+    后续片段都派发给同一个识别进程，直到最终片段。
+    换用新模型时，旧识别进程标记为排空：不再接新任务，只把手上的任务识别完。
+    """
+
+    PRIORITY_MIC_FINAL = 0
+    PRIORITY_MIC = 1
+    PRIORITY_FILE = 2
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queues: Dict[str, Deque[Task]] = {}      # task_id -> 该任务排队中的片段
+        self.clients: Dict[str, ClientShare] = {}     # socket_id -> 份额记账
+        self.task_served: Dict[str, float] = {}       # task_id -> 已派发的音频秒数
+        self.dropped: Dict[str, Tuple[str, str]] = {} # task_id -> (socket_id, 原因)，已放弃、还在等最终片段的任务
+        self.wait_stats: Dict[str, Dict] = {}         # source -> 排队时长统计
+        self.skip_stats: Dict[str, Dict] = {}         # 原因 -> 放弃的片段数与音频秒数
+        self.workers: Set[int] = set()                # 可派发的识别进程 id
+        self.idle: Set[int] = set()                   # 空闲的识别进程 id
+        self.affinity: Dict[str, int] = {}            # task_id -> 持有其中间结果的识别进程 id
+        self.draining: Set[int] = set()               # 排空中、不接新任务的识别进程 id
+
+    def add_worker(self, worker_id: int):
+        """登记识别进程，等它报告空闲后才会派发"""
+        with self.cond:
+            self.workers.add(worker_id)
+
+    def worker_ready(self, worker_id: int):
+        """识别进程报告空闲"""
+        with self.cond:
+            if worker_id in self.workers:
+                self.idle.add(worker_id)
+                self.cond.notify()
+
+    def retire_worker(self, worker_id: int) -> bool:
+        """识别进程空闲、且不持有任何任务的中间结果时，才可以退役"""
+        with self.cond:
+            if worker_id not in self.idle or worker_id in self.affinity.values():
+                return False
+            self.workers.discard(worker_id)
+            self.idle.discard(worker_id)
+            self.draining.discard(worker_id)
+            return True
+
+    def drain(self, worker_ids):
+        """这些识别进程不再接新任务，已开始的任务仍派发给它们"""
+        with self.cond:
+            self.draining.update(worker_ids)
+            self.cond.notify()
+
+    def register(self, socket_id: str, addr: str):
+        """登记客户端，权重由 Config.client_weights 按地址指定，默认为 1"""
+        with self.cond:
+            weight = Config.client_weights.get(addr, 1)
+            self.clients[socket_id] = ClientShare(addr, weight)
+
+    def put(self, task: Task):
+        with self.cond:
+            client = self.clients.get(task.socket_id)
+            if client is None:
+                return
+            # 已放弃的任务，最终片段换成清理标记，其余片段直接丢弃
+            if task.task_id in self.dropped:
+                reason = self.dropped[task.task_id][1]
+                self.record_skip(reason, task_seconds(task))
+                if not task.is_final:
+                    return
+                self.dropped.pop(task.task_id)
+                task.data, task.skip = b'', reason
+            # 刚变为活跃的客户端，虚拟时间追平其它活跃客户端，不能凭闲置时攒下的份额独占
+            if not client.queued:
+                active = [c.vtime for c in self.clients.values() if c.queued]
+                if active:
+                    client.vtime = max(client.vtime, min(active))
+            client.queued += task_seconds(task)
+            self.queues.setdefault(task.task_id, deque()).append(task)
+            self.cond.notify()
+
+    def cancel(self, socket_id: str, task_id: str):
+        """客户端取消了任务"""
+        with self.cond:
+            queue = self.queues.get(task_id)
+            if queue and queue[0].socket_id != socket_id:
+                return
+            if queue or task_id in self.affinity:
+                self.drop(task_id, socket_id, 'cancelled')
+
+    def drop_socket(self, socket_id: str):
+        """连接断开后，丢弃它排队中的片段和份额记账"""
+        with self.cond:
+            for task_id in [k for k, q in self.queues.items() if q[0].socket_id == socket_id]:
+                self.drop(task_id, socket_id, 'disconnected')
+            for task_id in [k for k, v in self.dropped.items() if v[0] == socket_id]:
+                self.dropped.pop(task_id)
+            self.clients.pop(socket_id, None)
+
+    def drop(self, task_id: str, socket_id: str, reason: str):
+        """放弃一个任务，调用时须持有锁"""
+        queue = self.queues.pop(task_id, deque())
+        client = self.clients.get(socket_id)
+        for task in queue:
+            seconds = task_seconds(task)
+            self.record_skip(reason, seconds)
+            if client:
+                client.queued = max(client.queued - seconds, 0.0)
+
+        # 识别进程里没有它的中间结果，也没有排队的最终片段，就只需记下，等最终片段到来时丢弃
+        final = queue[-1] if queue and queue[-1].is_final else None
+        started = task_id in self.affinity
+        self.task_served.pop(task_id, None)
+        if final is None:
+            self.dropped[task_id] = (socket_id, reason)
+        if not final and not started:
+            return
+
+        # 派发一个空的最终片段，让识别进程清理该任务的中间结果
+        # 客户端的最终片段还没到，就标记为 cleanup，其结果不发给客户端
+        if final is None:
+            head = queue[0] if queue else None
+            final = Task(source=head.source if head else 'mic',
+                         data=b'', offset=0, overlap=0,
+                         task_id=task_id, socket_id=socket_id,
+                         is_final=True,
+                         time_start=head.time_start if head else 0,
+                         time_submit=time.time())
+            final.skip = 'cleanup'
+        else:
+            final.data, final.skip = b'', reason
+        self.queues[task_id] = deque([final])
+
+    def priority(self, queue: Deque[Task], now: float) -> int:
+        head = queue[0]
+        if head.source == 'mic':
+            if queue[-1].is_final:
+                return self.PRIORITY_MIC_FINAL
+            return self.PRIORITY_MIC
+        if now - head.time_submit > Config.file_max_wait:
+            return self.PRIORITY_MIC
+        return self.PRIORITY_FILE
+
+    def pick(self) -> Optional[Tuple[str, int]]:
+        """选出下一个要识别的任务 id 和派发给的识别进程 id，没有可派发的返回 None"""
+        now = time.time()
+
+        def key(task_id):
+            queue = self.queues[task_id]
+            client = self.clients.get(queue[0].socket_id)
+            return (self.priority(queue, now),
+                    client.vtime if client else 0.0,
+                    self.task_served.get(task_id, 0.0),
+                    queue[0].time_submit)
+
+        # 已开始的任务只能等它的识别进程空闲，新任务可以交给任一空闲、未在排空的识别进程
+        fresh = self.idle - self.draining
+        candidates = [k for k in self.queues
+                      if self.affinity.get(k) in self.idle
+                      or (k not in self.affinity and fresh)]
+        if not candidates:
+            return None
+        task_id = min(candidates, key=key)
+        if task_id in self.affinity:
+            return task_id, self.affinity[task_id]
+        return task_id, min(fresh)
+
+    def get(self) -> Tuple[int, Task]:
+        """阻塞，直到有空闲的识别进程和可派发给它的片段，返回 (识别进程 id, 片段)"""
+        with self.cond:
+            while True:
+                self.expire()
+                choice = self.pick()
+                if choice:
+                    break
+                self.cond.wait()
+            task_id, worker_id = choice
+            self.idle.discard(worker_id)
+            queue = self.queues[task_id]
+            task = queue.popleft()
+            if not queue:
+                self.queues.pop(task_id)
+
+            # 份额记账
+            seconds = task_seconds(task)
+            client = self.clients.get(task.socket_id) or ClientShare('', 1)
+            client.queued = max(client.queued - seconds, 0.0)
+            client.served += seconds
+            client.vtime += seconds / client.weight
+            if task.is_final:
+                self.task_served.pop(task_id, None)
+                self.affinity.pop(task_id, None)
+            else:
+                self.task_served[task_id] = self.task_served.get(task_id, 0.0) + seconds
+                self.affinity[task_id] = worker_id
+
+            task.time_dispatch = time.time()
+            self.record_wait(task.source, task.time_dispatch - task.time_submit)
+        return worker_id, task
+
+    def expire(self):
+        """放弃已过截止时刻的任务，以其最新片段的截止时刻为准，调用时须持有锁"""
+        now = time.time()
+        for task_id, queue in list(self.queues.items()):
+            if queue[0].skip or not queue[-1].deadline:
+                continue
+            if now > queue[-1].deadline:
+                self.drop(task_id, queue[0].socket_id, 'expired')
+
+    def record_skip(self, reason: str, seconds: float):
+        stats = self.skip_stats.setdefault(reason, {'count': 0, 'seconds': 0.0})
+        stats['count'] += 1
+        stats['seconds'] += seconds
+
+    def record_wait(self, source: str, wait: float):
+        stats = self.wait_stats.setdefault(source, {'count': 0, 'total': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['total'] += wait
+        stats['max'] = max(stats['max'], wait)
+
+    def wait_summary(self) -> Dict[str, Dict]:
+        """各来源的片段排队时长：次数、平均、最大"""
+        with self.cond:
+            return {source: {'count': s['count'],
+                             'mean': s['total'] / s['count'],
+                             'max': s['max']}
+                    for source, s in self.wait_stats.items()}
+
+    def client_summary(self) -> Dict[str, Dict]:
+        """各客户端的排队音频秒数、已识别音频秒数、权重"""
+        with self.cond:
+            return {socket_id: {'addr': c.addr,
+                                'weight': c.weight,
+                                'queued': c.queued,
+                                'served': c.served}
+                    for socket_id, c in self.clients.items()}
+
+
+    def load(self) -> Dict[str, float]:
+        """扩缩容依据：排队音频秒数、最久的片段已等待秒数、空闲识别进程数"""
+        with self.cond:
+            now = time.time()
+            heads = [q[0].time_submit for q in self.queues.values()]
+            return {'queued': sum(c.queued for c in self.clients.values()),
+                    'wait': now - min(heads) if heads else 0.0,
+                    'idle': len(self.idle)}
+
+    def skip_summary(self) -> Dict[str, Dict]:
+        """各放弃原因的片段数与音频秒数"""
+        with self.cond:
+            return {reason: dict(s) for reason, s in self.skip_stats.items()}
+
+
+def task_seconds(task: Task) -> float:
+    """片段的音频时长，float32 每个采样 4 字节"""
+    return len(task.data) / 4 / task.samplerate
+
@@ -0,0 +1,36 @@
+"""
+按负载选择分段长度与重叠
+
+空闲时麦克风录音用短的分段，每段录满就识别，松开按键时剩下要识别的尾巴短，出字快；
+繁忙时用长的分段、短的重叠，重复识别的部分少，吞吐量高。
+负载以积压时长衡量：排队音频秒数 × 实测实时率 / 识别进程数，即识别完当前积压大约要多少秒。
+"""
+
+from typing import Tuple
+
+from config import ServerConfig as Config
+from util.server_cosmic import Cosmic
+
+
+def backlog_seconds() -> float:
+    """识别完当前排队的音频大约还要多少秒"""
+    queued = Cosmic.scheduler.load()['queued']
+    return queued * Cosmic.pool.rtf() / max(len(Cosmic.pool.workers), 1)
+
+
+def choose_segment(source: str, seg_duration: float, seg_overlap: float) -> Tuple[float, float]:
+    """
+    为一个录音任务选择 (分段长度, 重叠)，未开启 Config.adaptive_segment 时沿用客户端的设置
+
+    积压为 0 时取 Config.seg_ranges 里该来源的最短分段和最长重叠，
+    积压达到 Config.adaptive_busy 秒时取最长分段和最短重叠，其间线性过渡
+    """
+    if not Config.adaptive_segment or source not in Config.seg_ranges:
+        return seg_duration, seg_overlap
+
+    pressure = min(backlog_seconds() / Config.adaptive_busy, 1.0)
+    shortest, longest = Config.seg_ranges[source]
+    least, most = Config.overlap_range
+    duration = round(shortest + (longest - shortest) * pressure)
+    overlap = round(most - (most - least) * pressure, 1)
+    return duration, overlap
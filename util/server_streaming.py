@@ -0,0 +1,142 @@
+"""
+流式识别：麦克风音频边收边送进 sherpa-onnx 的 OnlineRecognizer，识别出的文字一变就推给客户端
+
+流式模型在单独的进程里运行，每个录音任务一个常驻的 stream，
+各任务攒够一帧的 stream 在一次 decode_streams 里批量识别。
+中间结果只供客户端显示，最终文字仍由离线模型识别、加标点后发出。
+
+主进程送来的消息为 (socket id, 任务 id, 音频, 是否结束)：
+    音频为 None 表示放弃该任务，不再推送；任务 id 为 None 表示该连接已断开。
+"""
+
+import queue
+import signal
+import time
+from multiprocessing import Process, Queue
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from config import ServerConfig as Config
+from util.server_cosmic import console, spawn_context
+from util.server_classes import Result
+
+TAIL_PADDING = 0.5      # 录音结束时补的静音秒数，让流式模型吐出最后几个字
+
+# 模型种类 -> sherpa-onnx 的构造方法
+FACTORIES = {
+    'paraformer': 'from_paraformer',
+    'transducer': 'from_transducer',
+}
+
+
+def streaming_available() -> bool:
+    """开启了流式识别且模型文件都在"""
+    if not Config.streaming:
+        return False
+    missing = [path for key, path in Config.streaming_model.items()
+               if key != 'kind' and not Path(path).exists()]
+    for path in missing:
+        console.print(f'未找到流式模型文件 {path}，不推送中间结果', style='yellow')
+    return not missing
+
+
+def create_online_recognizer():
+    import sherpa_onnx
+    spec = Config.streaming_model
+    factory = getattr(sherpa_onnx.OnlineRecognizer, FACTORIES[spec['kind']])
+    args = {key: value for key, value in spec.items() if key != 'kind'}
+    return factory(**{**args, 'num_threads': Config.streaming_threads})
+
+
+class Partial:
+    """一个录音任务的流式识别状态"""
+
+    def __init__(self, stream, time_start: float) -> None:
+        self.stream = stream
+        self.time_start = time_start
+        self.text = ''              # 已推送的文字，不变就不再推送
+        self.finished = False
+
+
+def start_streamer(queue_in: Queue, queue_out: Queue) -> Optional[Process]:
+    """启动流式识别进程，未开启或模型缺失时返回 None；与识别进程一样用 spawn 启动，队列也须由 spawn_context 创建"""
+    if not streaming_available():
+        return None
+    process = spawn_context.Process(target=serve_streaming, args=(queue_in, queue_out), daemon=True)
+    process.start()
+    return process
+
+
+def serve_streaming(queue_in: Queue, queue_out: Queue):
+    # Ctrl-C 退出
+    signal.signal(signal.SIGINT, lambda signum, frame: exit())
+
+    t1 = time.time()
+    try:
+        recognizer = create_online_recognizer()
+    except Exception as e:
+        console.print(f'流式模型载入失败，不推送中间结果：{e}', style='bright_red')
+        return
+    console.print(f'[green4]流式模型载入完成，耗时 {time.time() - t1:.2f}s', end='\n\n')
+
+    partials: Dict[tuple, Partial] = {}
+    while True:
+        # 取出积压的全部音频再识别，多个任务的 stream 一起批量识别
+        messages = [queue_in.get()]
+        while True:
+            try:
+                messages.append(queue_in.get_nowait())
+            except queue.Empty:
+                break
+
+        for message in messages:
+            if message is None:
+                return
+            accept(recognizer, partials, *message)
+
+        ready = [p.stream for p in partials.values() if recognizer.is_ready(p.stream)]
+        while ready:
+            recognizer.decode_streams(ready)
+            ready = [s for s in ready if recognizer.is_ready(s)]
+
+        for key, partial in list(partials.items()):
+            text = recognizer.get_result(partial.stream)
+            if text != partial.text:
+                partial.text = text
+                queue_out.put(partial_result(key, partial))
+            if partial.finished:
+                partials.pop(key)
+
+
+def accept(recognizer, partials: Dict[tuple, Partial], socket_id: str, task_id, data, is_final: bool):
+    """把一块音频送进对应任务的 stream"""
+    if task_id is None:
+        for key in [key for key in partials if key[0] == socket_id]:
+            partials.pop(key)
+        return
+    key = (socket_id, task_id)
+    if data is None:
+        partials.pop(key, None)
+        return
+
+    if key not in partials:
+        partials[key] = Partial(recognizer.create_stream(), time.time())
+    partial = partials[key]
+    partial.stream.accept_waveform(16000, np.frombuffer(data, dtype=np.float32))
+    if is_final:
+        partial.stream.accept_waveform(16000, np.zeros(int(TAIL_PADDING * 16000), dtype=np.float32))
+        partial.stream.input_finished()
+        partial.finished = True
+
+
+def partial_result(key: tuple, partial: Partial) -> Result:
+    socket_id, task_id = key
+    result = Result(task_id, socket_id, 'mic')
+    result.text = partial.text
+    result.is_partial = True
+    result.time_start = partial.time_start
+    result.time_submit = partial.time_start
+    result.time_complete = time.time()
+    return result
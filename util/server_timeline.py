@@ -0,0 +1,25 @@
+"""识别进程启动各阶段的耗时，进程内全局记录，由识别循环分批报告给主进程"""
+
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+phases: List[Tuple[str, float]] = []       # (阶段, 秒)
+reported = 0                                # 已报告到第几项
+
+
+@contextmanager
+def phase(name: str):
+    """记录一段代码的耗时"""
+    t1 = time.time()
+    try:
+        yield
+    finally:
+        phases.append((name, time.time() - t1))
+
+
+def flush() -> List[Tuple[str, float]]:
+    """取出上次之后新记录的阶段"""
+    global reported
+    new, reported = phases[reported:], len(phases)
+    return new
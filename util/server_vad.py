@@ -0,0 +1,116 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from config import ServerConfig as Config
+from util.server_cosmic import console
+
+
+@lru_cache(maxsize=None)
+def vad_available() -> bool:
+    """开启了 VAD 且模型文件存在"""
+    if not Path(Config.vad_model).exists():
+        console.print(f'未找到 VAD 模型 {Config.vad_model}，改为按固定长度切分', style='yellow')
+        return False
+    return True
+
+
+def create_vad(buffer_seconds: float = 100):
+    """创建 silero VAD，每个连接一个，它在相邻的窗口间保留状态"""
+    import sherpa_onnx
+    config = sherpa_onnx.VadModelConfig()
+    config.silero_vad.model = str(Config.vad_model)
+    config.silero_vad.min_silence_duration = Config.vad_silence
+    config.sample_rate = 16000
+    return sherpa_onnx.VoiceActivityDetector(config, buffer_size_in_seconds=buffer_seconds)
+
+
+class VadStream:
+    """按 silero 的窗口长度把音频流送进 VAD，取出已结束的语音段"""
+
+    window = 512                            # silero 每次处理的采样数
+
+    def __init__(self) -> None:
+        self.vad = create_vad()
+        self.pending = np.zeros(0, dtype=np.float32)
+
+    def feed(self, data: bytes) -> List[Tuple[int, List[float]]]:
+        """送入 float32 音频，返回新结束的语音段：[(起始采样点, 采样), ...]"""
+        self.pending = np.concatenate([self.pending, np.frombuffer(data, dtype=np.float32)])
+        n = len(self.pending) // self.window * self.window
+        for i in range(0, n, self.window):
+            self.vad.accept_waveform(self.pending[i:i + self.window])
+        self.pending = self.pending[n:]
+
+        segments = []
+        while not self.vad.empty():
+            segments.append((self.vad.front.start, self.vad.front.samples))
+            self.vad.pop()
+        return segments
+
+
+class Endpointer(VadStream):
+    """
+    用 VAD 找出音频流里的停顿，作为切分点
+
+    只用 VAD 判断语音段在哪里结束，切分的仍是原始音频，
+    所以语音段之间的静音也保留在片段里，时间戳与音频流一一对应。
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pad = int(Config.vad_silence / 2 * 16000)   # 切在语音段结束后的静音中间
+
+    def accept(self, data: bytes) -> List[int]:
+        """送入 float32 音频，返回新找到的切分点（从录音开始算的采样数）"""
+        return [start + len(samples) + self.pad for start, samples in self.feed(data)]
+
+
+def quietest_cut(chunks: bytes, seconds: float, search: float = 3) -> int:
+    """
+    一直没有停顿时的切分点：在前 seconds 秒的最后 search 秒里，
+    找能量最低的 0.1 秒，切在它中间，尽量不把字切开，返回切分点的字节数
+    """
+    frame = 1600
+    end = int(seconds * 16000) // frame * frame
+    start = max(end - int(search * 16000) // frame * frame, 0)
+    samples = np.frombuffer(chunks[start * 4:end * 4], dtype=np.float32)
+    energy = (samples.reshape(-1, frame) ** 2).mean(axis=1)
+    return (start + int(energy.argmin()) * frame + frame // 2) * 4
+
+
+class Segmenter(VadStream):
+    """
+    转录文件时用 VAD 找出语音区间，丢弃静音
+
+    sherpa-onnx 的 VAD 没有 flush，最后一段语音要等到足够长的静音才会结束，
+    所以收完音频后补一段静音，让它把最后一段吐出来。
+    过长的区间在分段长度之内最安静的地方再切开，免得一次识别太长的音频。
+    """
+
+    def __init__(self, max_seconds: float) -> None:
+        super().__init__()
+        self.max_seconds = max_seconds
+
+    def accept(self, data: bytes) -> List[Tuple[int, np.ndarray]]:
+        """送入 float32 音频，返回新结束的语音区间：[(起始采样点, 采样), ...]"""
+        regions = []
+        for start, samples in self.feed(data):
+            regions += self.split(start, np.array(samples, dtype=np.float32))
+        return regions
+
+    def finish(self) -> List[Tuple[int, np.ndarray]]:
+        """音频收完，补静音让最后一段语音结束"""
+        silence = np.zeros(int((Config.vad_silence + 0.5) * 16000) + self.window, dtype=np.float32)
+        return self.accept(silence.tobytes())
+
+    def split(self, start: int, samples: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        regions = []
+        while len(samples) > self.max_seconds * 16000:
+            size = quietest_cut(samples.tobytes(), self.max_seconds) // 4
+            regions.append((start, samples[:size]))
+            start, samples = start + size, samples[size:]
+        regions.append((start, samples))
+        return regions
@@ -0,0 +1,389 @@
+import os
+import time
+import asyncio
+import threading
+from multiprocessing import Process, Queue
+from platform import system
+from typing import Dict, List, Optional
+
+import psutil
+
+from config import ServerConfig as Config
+from util.server_cosmic import console, spawn_context
+from util.server_init_recognizer import init_recognizer
+from util.server_prefork import init_model_host
+from util.server_scheduler import Scheduler
+from util.server_ws_send import broadcast
+from util.empty_working_set import trim_memory
+from util.server_check_model import reload_model_config
+
+
+class Worker:
+    """一个识别进程"""
+    def __init__(self, worker_id: int, queue_in: Queue, slot: int = -1, generation: int = 0) -> None:
+        self.worker_id = worker_id
+        self.generation = generation        # 第几代，每换一次模型加一
+        self.queue_in = queue_in            # 派发给它的片段
+        self.slot = slot                    # 占用的槽位，决定绑定哪段核，预派生模式下也决定从哪个队列取片段
+        self.pid = 0                        # 进程号，载入完成时由识别进程报告
+        self.time_start = time.time()       # 启动时刻
+        self.loaded = False                 # 模型是否已载入完成
+        self.punc_ready = False             # 标点模型是否已载入完成
+        self.last_active = time.time()      # 最近一次完成片段的时刻
+        self.trim = (0.0, 0.0)              # 最近一次释放内存前后的 RSS（MB）
+        self.latency = {}                   # 载入后首个片段与之后各片段平均的实时率
+        self.timeline = []                  # 启动各阶段的耗时：[(阶段, 秒), ...]
+
+    def memory(self) -> Dict[str, float]:
+        """常驻内存 RSS 与按共享比例分摊的 PSS（GB），不支持 PSS 的系统以 RSS 代替"""
+        return process_memory(self.pid)
+
+
+def process_memory(pid: int) -> Dict[str, float]:
+    if not pid:
+        return {'rss': 0.0, 'pss': 0.0}
+    try:
+        info = psutil.Process(pid).memory_full_info()
+    except (psutil.Error, ValueError):
+        return {'rss': 0.0, 'pss': 0.0}
+    rss = info.rss / 1024 ** 3
+    return {'rss': rss, 'pss': getattr(info, 'pss', info.rss) / 1024 ** 3}
+
+
+class WorkerPool:
+    """
+    管理识别进程：启动、派发片段、按排队情况扩缩容
+
+    排队音频秒数或最久等待时长超过阈值时，在 Config.max_workers 和 Config.max_memory
+    的限制内启动新的识别进程；识别进程空闲超过 Config.scale_down_idle 秒后退役，
+    但至少保留 Config.min_workers 个。
+
+    Config.worker_mode 为 'prefork' 时，由一个模型宿主进程载入一次模型，
+    再 fork 出识别进程共享模型权重，见 server_prefork.py。
+    内存上限按 PSS 计算，共享的权重只计一次。
+
+    连续 Config.idle_unload 分钟没有任务时，让识别进程释放模型；
+    有客户端连接或发来音频时立即重新载入，期间向客户端发送 warming_up 状态。
+
+    语音模型与标点模型的就绪情况有变化时，向客户端广播 status 消息：
+        {'type': 'status', 'state': 'ready'、'cold' 或 'warming_up', 'asr_ready': bool, 'punc_ready': bool}
+    asr_ready 后即可识别；punc_ready 之前，听写结果按停顿加标点立即发出，
+    文件转录结果最多等标点模型 Config.punc_wait 秒。
+
+    换用新模型（swap）时，按新配置启动新一代识别进程，旧进程继续服务；
+    新进程载入完成后，旧进程排空：不接新任务，手上的任务识别完即退役。
+    新旧两代同时载入期间，内存占用会暂时翻倍。
+    """
+
+    def __init__(self, scheduler: Scheduler, queue_out: Queue, queue_event: Queue, sockets_id):
+        self.scheduler = scheduler
+        self.queue_out = queue_out
+        self.queue_event = queue_event      # 识别进程报告事件：(id, 'loaded', 进程号) 或 (id, 'ready', None) 等
+        self.sockets_id = sockets_id
+        self.workers: Dict[int, Worker] = {}
+        self.next_id = 0
+        self.ready = threading.Event()      # 至少一个识别进程已就绪
+        self.capped = False                 # 是否因内存上限暂停扩容，避免重复打印
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock = threading.Lock()
+        self.last_task = time.time()        # 最近一次派发片段的时刻
+        self.cold = False                   # 模型是否因空闲已释放
+        self.warming = set()                # 正在重新载入模型的识别进程 id
+        self.published = {}                 # 最近一次广播的状态
+        self.main_trim = (0.0, 0.0)         # 主进程最近一次释放内存前后的 RSS（MB）
+        self.generation = 0                 # 当前一代识别进程，新任务只派发给它们
+        self.swap_requested = False         # 换模型请求，由扩缩容线程执行，启停进程只在一个线程里做
+        self.old_hosts = []                 # 预派生模式下旧一代的 (模型宿主, 指令队列)，旧进程退役完后关闭
+
+        # 预派生模式：模型宿主进程、给它的指令队列、各槽位的片段队列
+        self.prefork = Config.worker_mode == 'prefork' and system() != 'Windows'
+        self.host: Optional[Process] = None
+        self.commands = spawn_context.Queue()
+        self.slots = [spawn_context.Queue() for _ in range(Config.max_workers)] if self.prefork else []
+        if Config.worker_mode == 'prefork' and not self.prefork:
+            console.print('Windows 不支持 fork，预派生模式改为逐个进程载入模型', style='yellow')
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        if self.prefork:
+            self.start_host()
+        for _ in range(max(Config.min_workers, 1)):
+            self.spawn()
+        for target in (self.listen, self.dispatch, self.autoscale):
+            threading.Thread(target=target, daemon=True).start()
+
+    def start_host(self):
+        """启动预派生模式的模型宿主"""
+        # 宿主要 fork 子进程，所以不能是 daemon 进程，它会在主进程退出后自行退出
+        self.host = spawn_context.Process(target=init_model_host,
+                                          args=(self.commands,
+                                                self.slots,
+                                                self.queue_out,
+                                                self.queue_event,
+                                                self.sockets_id))
+        self.host.start()
+
+    def spawn(self) -> Worker:
+        """启动一个识别进程"""
+        worker_id, self.next_id = self.next_id, self.next_id + 1
+        # 同一代识别进程的槽位互不相同，退役空出的槽位给新进程
+        used = {w.slot for w in self.workers.values() if w.generation == self.generation}
+        slot = next(i for i in range(Config.max_workers) if i not in used)
+        if self.prefork:
+            worker = Worker(worker_id, self.slots[slot], slot, self.generation)
+            self.commands.put((worker_id, slot))
+        else:
+            worker = Worker(worker_id, spawn_context.Queue(), slot, self.generation)
+            spawn_context.Process(target=init_recognizer,
+                                  args=(worker_id,
+                                        slot,
+                                        worker.queue_in,
+                                        self.queue_out,
+                                        self.queue_event,
+                                        self.sockets_id),
+                                  daemon=True).start()
+        self.workers[worker_id] = worker
+        self.scheduler.add_worker(worker_id)
+        return worker
+
+    def retire(self, worker: Worker):
+        """让识别进程退出"""
+        self.workers.pop(worker.worker_id)
+        worker.queue_in.put(None)
+
+    def stop(self):
+        for worker in list(self.workers.values()):
+            self.retire(worker)
+        if self.host:
+            self.commands.put(None)
+        for _, commands in self.old_hosts:
+            commands.put(None)
+
+    @property
+    def swapping(self) -> bool:
+        """是否正在换模型"""
+        return self.swap_requested or any(w.generation < self.generation for w in list(self.workers.values()))
+
+    def swap(self) -> List[str]:
+        """
+        按 config.py 里新的 ModelPaths、ParaformerArgs 换用新模型，不中断服务
+
+        返回缺失的模型文件，为空表示已开始换模型
+        """
+        missing = reload_model_config()
+        if not missing:
+            self.swap_requested = True
+        return [str(path) for path in missing]
+
+    def start_generation(self):
+        """启动新一代识别进程，数量与当前相同"""
+        count = max(len(self.workers), Config.min_workers, 1)
+        self.generation += 1
+        if self.prefork:
+            self.old_hosts.append((self.host, self.commands))
+            self.commands = spawn_context.Queue()
+            self.slots = [spawn_context.Queue() for _ in range(Config.max_workers)]
+            self.start_host()
+        for _ in range(count):
+            self.spawn()
+        console.print(f'换用新模型：启动第 {self.generation} 代识别进程 {count} 个，'
+                      f'载入完成前旧进程继续服务', style='yellow')
+
+    def retire_drained(self):
+        """退役已排空的旧识别进程，旧一代全部退役后关闭其模型宿主"""
+        old = [w for w in list(self.workers.values()) if w.generation < self.generation]
+        for worker in old:
+            if worker.worker_id in self.scheduler.draining and self.scheduler.retire_worker(worker.worker_id):
+                self.retire(worker)
+                console.print(f'换用新模型：旧识别进程 {worker.worker_id} 已排空，退役', style='yellow')
+        if self.old_hosts and not any(w.generation < self.generation for w in self.workers.values()):
+            for _, commands in self.old_hosts:
+                commands.put(None)
+            self.old_hosts.clear()
+
+    def listen(self):
+        """接收识别进程报告的事件"""
+        while True:
+            worker_id, event, value = self.queue_event.get()
+            worker = self.workers.get(worker_id)
+            if worker is None:
+                continue
+            if event == 'timeline':
+                worker.timeline += value
+                if worker.loaded:           # 就绪后才载入完的阶段，如后台载入的标点模型
+                    console.print(f'识别进程 {worker_id} 启动时间线：' +
+                                  '，'.join(f'{name} {seconds:.2f}s' for name, seconds in value), style='bright_black')
+            elif event == 'loaded':
+                worker.pid = value
+                worker.loaded = True
+                memory = worker.memory()
+                total = time.time() - worker.time_start
+                other = total - sum(seconds for _, seconds in worker.timeline)
+                console.print(f'识别进程 {worker_id} 启动时间线：' +
+                              '，'.join(f'{name} {seconds:.2f}s' for name, seconds in worker.timeline) +
+                              f'，进程启动等其它 {max(other, 0):.2f}s', style='bright_black')
+                console.print(f'识别进程 {worker_id} 就绪，'
+                              f'启动耗时 {total:.2f}s，'
+                              f'内存 RSS {memory["rss"]:.2f}GB，PSS {memory["pss"]:.2f}GB', style='green4')
+                self.ready.set()
+                self.publish_status()
+
+                # 新一代的首个进程就绪，旧进程不再接新任务
+                old = [w.worker_id for w in list(self.workers.values()) if w.generation < worker.generation]
+                if old and not set(old) <= self.scheduler.draining:
+                    self.scheduler.drain(old)
+                    console.print(f'换用新模型：新模型已就绪，旧识别进程 {old} 识别完手上的任务后退役', style='yellow')
+            elif event == 'ready':
+                worker.last_active = time.time()
+                self.scheduler.worker_ready(worker_id)
+            elif event == 'latency':
+                worker.latency = value
+                if value['count'] == 1:
+                    console.print(f'识别进程 {worker_id} 载入后首个片段实时率 {value["first"]:.3f}', style='bright_black')
+                elif value['count'] == 11:
+                    console.print(f'识别进程 {worker_id} 稳态实时率 {value["steady"]:.3f}，'
+                                  f'首个片段 {value["first"]:.3f}', style='bright_black')
+            elif event == 'trimmed':
+                worker.trim = value
+                console.print(f'识别进程 {worker_id} 释放内存：RSS {value[0]:.0f}MB → {value[1]:.0f}MB', style='bright_black')
+            elif event == 'punc_ready':
+                worker.punc_ready = value
+                if value:
+                    console.print(f'识别进程 {worker_id} 标点模型就绪', style='green4')
+                self.publish_status()
+            elif event == 'unloaded':
+                worker.punc_ready = False
+            elif event == 'reloaded':
+                console.print(f'识别进程 {worker_id} 重新载入模型，冷启动耗时 {value:.2f}s', style='green4')
+                with self.lock:
+                    self.warming.discard(worker_id)
+                self.publish_status()
+
+    def status(self) -> Dict:
+        """语音模型与标点模型的就绪情况，标点模型以全部已载入的识别进程都就绪为准"""
+        loaded = [w for w in list(self.workers.values()) if w.loaded]
+        asr_ready = bool(loaded) and not self.cold and not self.warming
+        return {'type': 'status',
+                'state': 'warming_up' if self.warming else 'cold' if self.cold else 'ready',
+                'asr_ready': asr_ready,
+                'punc_ready': asr_ready and (not Config.format_punc or all(w.punc_ready for w in loaded))}
+
+    def publish_status(self):
+        """状态有变化时广播给所有客户端"""
+        status = self.status()
+        if status != self.published:
+            self.published = status
+            self.notify(status)
+
+    def trim_main(self):
+        """主进程把空闲内存还给系统，可在线程里调用"""
+        self.main_trim = trim_memory()
+        console.print(f'主进程释放内存：RSS {self.main_trim[0]:.0f}MB → {self.main_trim[1]:.0f}MB', style='bright_black')
+
+    def main_summary(self) -> Dict:
+        """主进程的内存占用与最近一次释放前后的 RSS"""
+        return {'pid': os.getpid(), **process_memory(os.getpid()),
+                'trim_before': self.main_trim[0], 'trim_after': self.main_trim[1]}
+
+    def notify(self, message: dict):
+        """从线程里向所有客户端广播状态"""
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(broadcast(message), self.loop)
+
+    def unload(self):
+        """长时间空闲，让识别进程释放模型"""
+        with self.lock:
+            if self.cold:
+                return
+            self.cold = True
+            for worker in self.workers.values():
+                worker.queue_in.put('unload')
+        console.print(f'已空闲 {(time.time() - self.last_task) / 60:.0f} 分钟，释放模型', style='yellow')
+        self.publish_status()
+
+    def warm(self) -> bool:
+        """有客户端连接或发来音频，模型已释放的话就重新载入，返回是否仍在预热"""
+        with self.lock:
+            if self.cold:
+                self.cold = False
+                self.last_task = time.time()    # 重新计算空闲时长，否则下一轮检查又会释放
+                self.warming = set(self.workers)
+                for worker in self.workers.values():
+                    worker.queue_in.put('load')
+                console.print('有客户端活动，重新载入模型', style='yellow')
+        self.publish_status()
+        return bool(self.warming)
+
+    def rtf(self) -> float:
+        """各识别进程实测的平均实时率，还没有识别过片段时按 1 估计"""
+        rates = [w.latency['steady'] if w.latency.get('count', 0) > 1 else w.latency['first']
+                 for w in list(self.workers.values()) if w.latency.get('count')]
+        return sum(rates) / len(rates) if rates else 1.0
+
+    def summary(self) -> Dict[str, Dict]:
+        """各识别进程的内存占用，预派生模式下包括模型宿主"""
+        summary = {str(w.worker_id): {'pid': w.pid, 'loaded': w.loaded, **w.memory(),
+                                      'trim_before': w.trim[0], 'trim_after': w.trim[1],
+                                      'latency': w.latency, 'timeline': w.timeline}
+                   for w in list(self.workers.values())}
+        if self.host:
+            summary['host'] = {'pid': self.host.pid, 'loaded': True, **process_memory(self.host.pid)}
+        return summary
+
+    def dispatch(self):
+        """把调度器选出的片段交给对应的识别进程"""
+        while True:
+            worker_id, task = self.scheduler.get()
+            self.last_task = time.time()
+            worker = self.workers.get(worker_id)
+            if worker is not None:
+                worker.queue_in.put(task)
+
+    def autoscale(self):
+        """每秒检查一次负载，决定是否扩缩容"""
+        while True:
+            time.sleep(1)
+
+            # 换模型
+            if self.swap_requested:
+                self.swap_requested = False
+                self.start_generation()
+            self.retire_drained()
+
+            # 长时间没有任务，释放模型；预派生模式的模型在宿主进程里，识别进程释放不了
+            idle = time.time() - self.last_task
+            if Config.idle_unload and not self.prefork and idle > Config.idle_unload * 60:
+                self.unload()
+
+            load = self.scheduler.load()
+            workers = list(self.workers.values())
+            loading = [w for w in workers if not w.loaded]
+            memory = sum(m['pss'] for m in self.summary().values())
+            metrics = (f'排队音频 {load["queued"]:.1f}s，最久等待 {load["wait"]:.1f}s，'
+                       f'空闲 {load["idle"]}/{len(workers)}，内存 PSS {memory:.2f}GB')
+
+            # 扩容：同一时刻只载入一个新进程，新进程按已有识别进程的平均内存估算
+            busy = load['queued'] > Config.scale_up_queued or load['wait'] > Config.scale_up_wait
+            if busy and not loading and len(workers) < Config.max_workers:
+                per_worker = sum(w.memory()['pss'] for w in workers) / len(workers) if workers else 0
+                if memory + per_worker > Config.max_memory:
+                    if not self.capped:
+                        self.capped = True
+                        console.print(f'暂不扩容：将超出内存上限 {Config.max_memory}GB（{metrics}）', style='yellow')
+                    continue
+                self.capped = False
+                worker = self.spawn()
+                console.print(f'扩容：启动识别进程 {worker.worker_id}（{metrics}）', style='yellow')
+                continue
+
+            # 缩容：空闲最久的进程超过冷却时间后退役
+            if busy or len(workers) <= Config.min_workers:
+                continue
+            idle = [w for w in workers if w.loaded and time.time() - w.last_active > Config.scale_down_idle]
+            if not idle:
+                continue
+            worker = min(idle, key=lambda w: w.last_active)
+            if self.scheduler.retire_worker(worker.worker_id):
+                self.retire(worker)
+                console.print(f'缩容：退役识别进程 {worker.worker_id}，'
+                              f'已空闲 {time.time() - worker.last_active:.0f}s（{metrics}）', style='yellow')
@@ -1,13 +1,20 @@
+import hmac
 import json 
 import time
 import base64 
 import asyncio
 import websockets
+from typing import List
 from base64 import b64decode
 
+from config import ServerConfig as Config
 from util.server_cosmic import console, Cosmic
-from util.server_classes import Task, Result
+from util.server_classes import Task, Result, REFINE_SUFFIX
 from util.my_status import Status
+from util.asyncio_to_thread import to_thread
+from util.server_segment import choose_segment
+from util.server_vad import Endpointer, Segmenter, vad_available, quietest_cut
+from util.server_ws_send import forget_socket
 
 status_mic = Status('正在接收音频', spinner='point')
 
@@ -18,33 +25,110 @@ class Cache:
         self.chunks = b''
         self.offset = 0
         self.frame_num = 0
+        self.time_start = 0     # 录音开始时刻，换算到服务端时钟
+        self.seg_duration = 0   # 本次录音的分段长度和重叠，录音开始时选定
+        self.seg_overlap = 0
+        self.audio = b''        # 两遍识别时保留的整段麦克风录音
+        self.endpointer = None  # 麦克风录音按停顿切分时的 VAD
+        self.segmenter = None   # 文件按语音区间识别时的 VAD
+        self.regions = []       # 已找到、还没提交的语音区间：[(起始采样点, 采样), ...]
+
+
+def stream_audio(socket_id: str, task_id, data, is_final: bool):
+    """把麦克风音频转给流式识别进程，没有开启流式识别时什么也不做"""
+    if Cosmic.streamer and Cosmic.streamer.is_alive():
+        Cosmic.queue_stream.put((socket_id, task_id, data, is_final))
+
+
+def refine_tasks(message, audio: bytes, socket_id: str) -> List[Task]:
+    """两遍识别：整段录音按客户端的分段长度切分，交给 Config.mic_refine 指定的模型，按文件的优先级在后台识别"""
+    seg_duration, seg_overlap = message['seg_duration'], message['seg_overlap']
+    tasks, offset = [], 0
+    while True:
+        is_final = len(audio) / 4 / 16000 < seg_duration + seg_overlap * 2
+        tasks.append(Task(source='refine',
+                          data=audio if is_final else audio[:int(4 * 16000 * (seg_duration + seg_overlap))],
+                          offset=offset,
+                          task_id=message['task_id'] + REFINE_SUFFIX, socket_id=socket_id,
+                          overlap=seg_overlap, is_final=is_final,
+                          time_start=message['time_start'],
+                          time_submit=time.time(),
+                          model=Config.mic_refine,
+                          seg_duration=seg_duration))
+        if is_final:
+            return tasks
+        audio = audio[int(4 * 16000 * seg_duration):]
+        offset += seg_duration
+
+
+def mic_deadline(message, cache: Cache, audio_end: float) -> float:
+    """麦克风片段的截止时刻：片段音频结束时刻加上客户端的时延预算"""
+    if message['source'] != 'mic':
+        return 0
+    budget = message.get('latency_budget', Config.mic_latency_budget)
+    return cache.time_start + audio_end + budget
+
+
+def region_task(message, cache: Cache, socket_id: str, offset: float, is_final: bool) -> Task:
+    """把攒下的语音区间打包成一个任务，offset 为这批区间覆盖到的音频时刻"""
+    task = Task(source=message['source'],
+                data=b''.join(samples.tobytes() for _, samples in cache.regions),
+                offset=offset,
+                task_id=message['task_id'], socket_id=socket_id,
+                overlap=0, is_final=is_final,
+                time_start=message['time_start'],
+                time_submit=time.time(),
+                model=message.get('model', ''),
+                regions=[(start / 16000, len(samples) / 16000) for start, samples in cache.regions],
+                seg_duration=cache.seg_duration)
+    cache.regions = []
+    return task
 
 
 async def message_handler(websocket, message, cache: Cache):
     """处理得到的音频流数据"""
 
-    queue_in = Cosmic.queue_in
+    scheduler = Cosmic.scheduler
 
     global status_mic
     source = message['source']
     is_final = message['is_final']
-    is_start = not bool(cache.chunks)
+    is_start = not cache.frame_num     # 按停顿切分时缓冲区可能恰好切空，不能据此判断
 
     # 获取 id
     task_id = message['task_id']
     socket_id = str(websocket.id)
 
-    # 获取分段长度（以多长的音频进行识别）
-    seg_duration = message['seg_duration']
-    seg_overlap = message['seg_overlap']
+    # 获取分段长度（以多长的音频进行识别），录音开始时按负载选定，整个录音不变
+    if is_start:
+        cache.seg_duration, cache.seg_overlap = choose_segment(
+            source, message['seg_duration'], message['seg_overlap'])
+    seg_duration = cache.seg_duration
+    seg_overlap = cache.seg_overlap
     seg_threshold = seg_duration + seg_overlap * 2
 
+    # 按键还按着时就提前识别已录下的部分，录满一段加重叠就提交，松开时末尾最多剩一段加重叠
+    if source == 'mic' and Config.mic_speculate:
+        seg_duration = min(seg_duration, Config.mic_speculate)
+        seg_threshold = seg_duration + seg_overlap
 
     # base64 解码音频数据，再
     # 音频数据是 float32、单声道、16000采样率
     data = b64decode(message['data'])
     cache.chunks += data
     cache.frame_num += len(data)
+    if source == 'mic':
+        stream_audio(socket_id, task_id, data, is_final)
+        if Config.mic_refine:
+            cache.audio += data
+
+    # 用客户端时钟的差值换算录音开始时刻，避免两端时钟不一致
+    if is_start:
+        cache.time_start = time.time() - (message['time_frame'] - message['time_start'])
+        if source == 'mic' and Config.mic_vad and vad_available():
+            cache.endpointer = Endpointer()
+        if source == 'file' and Config.file_vad and vad_available():
+            cache.segmenter = Segmenter(seg_duration)
 
     if not is_final:
         # 打印消息
@@ -53,18 +137,51 @@ async def message_handler(websocket, message, cache: Cache):
         if source == 'file' and is_start:
             console.print('正在接收音频文件...')
 
+        # 在停顿处切分，片段不重叠；一直没有停顿，就在分段长度之内最安静的地方切
+        if cache.endpointer:
+            cuts = [cut * 4 - (cache.frame_num - len(cache.chunks))
+                    for cut in await to_thread(cache.endpointer.accept, data)]
+            cuts = [size for size in cuts if size >= 4 * 16000 * Config.vad_min_segment]
+            while cuts or len(cache.chunks) / 4 / 16000 >= seg_threshold:
+                size = min(cuts.pop(0), len(cache.chunks)) if cuts else quietest_cut(cache.chunks, seg_duration)
+                task = Task(source=message['source'],
+                            data=cache.chunks[:size], offset=cache.offset,
+                            task_id=task_id, socket_id=socket_id,
+                            overlap=0, is_final=False,
+                            time_start=message['time_start'],
+                            time_submit=time.time(),
+                            deadline=mic_deadline(message, cache, cache.offset + size / 4 / 16000),
+                            model=message.get('model', ''),
+                            seg_duration=seg_duration)
+                cache.chunks = cache.chunks[size:]
+                cache.offset += size / 4 / 16000
+                cuts = [cut - size for cut in cuts if cut - size >= 4 * 16000 * Config.vad_min_segment]
+                scheduler.put(task)
+
+        # 文件只保留语音区间，攒够一批再提交，静音直接丢弃
+        if cache.segmenter:
+            cache.regions += await to_thread(cache.segmenter.accept, data)
+            cache.chunks = b''
+            if sum(len(samples) for _, samples in cache.regions) >= Config.file_vad_batch * 16000:
+                start, samples = cache.regions[-1]
+                scheduler.put(region_task(message, cache, socket_id, (start + len(samples)) / 16000, False))
+
         # 若缓冲已达到分段长度，将片段作为任务提交
-        while len(cache.chunks) / 4 / 16000 >= seg_threshold:
-            data = cache.chunks[:4 * 16000 * (seg_duration + seg_overlap)]
-            cache.chunks = cache.chunks[4 * 16000 * seg_duration:]
+        while not cache.endpointer and not cache.segmenter and len(cache.chunks) / 4 / 16000 >= seg_threshold:
+            data = cache.chunks[:int(4 * 16000 * (seg_duration + seg_overlap))]
+            cache.chunks = cache.chunks[int(4 * 16000 * seg_duration):]
             task = Task(source=message['source'],
                         data=data, offset=cache.offset,
                         task_id=task_id, socket_id=socket_id,
                         overlap=seg_overlap, is_final=False,
                         time_start=message['time_start'],
-                        time_submit=time.time())
+                        time_submit=time.time(),
+                        deadline=mic_deadline(message, cache,
+                                              cache.offset + seg_duration + seg_overlap),
+                        model=message.get('model', ''),
+                        seg_duration=seg_duration)
             cache.offset += seg_duration
-            queue_in.put(task)
+            scheduler.put(task)
 
     elif is_final:
         # 打印消息
@@ -74,18 +191,84 @@ async def message_handler(websocket, message, cache: Cache):
             print(f'音频文件接收完毕，时长 {cache.frame_num / 16000 / 4:.2f}s')
 
         # 客户端说片段结束，将缓冲区音频识别
-        task = Task(source=message['source'],
-                    data=cache.chunks[0:], offset=cache.offset,
-                    task_id=task_id, socket_id=socket_id,
-                    overlap=seg_overlap, is_final=True,
-                    time_start=message['time_start'],
-                    time_submit=time.time())
-        queue_in.put(task)
+        if cache.segmenter:
+            cache.regions += await to_thread(cache.segmenter.accept, data)    # 最后一条消息也带着音频
+            cache.regions += await to_thread(cache.segmenter.finish)
+            task = region_task(message, cache, socket_id, cache.frame_num / 4 / 16000, True)
+        else:
+            task = Task(source=message['source'],
+                        data=cache.chunks[0:], offset=cache.offset,
+                        task_id=task_id, socket_id=socket_id,
+                        overlap=0 if cache.endpointer else seg_overlap, is_final=True,
+                        time_start=message['time_start'],
+                        time_submit=time.time(),
+                        deadline=mic_deadline(message, cache,
+                                              cache.offset + len(cache.chunks) / 4 / 16000),
+                        model=message.get('model', ''),
+                        seg_duration=seg_duration)
+        # 初稿已放弃的，不必再重新识别；提交最终片段后就查不到了，所以先查
+        refine = source == 'mic' and Config.mic_refine and task_id not in scheduler.dropped
+        scheduler.put(task)
+
+        # 初稿之后，再用准确的模型重新识别整段录音
+        if refine:
+            for task in refine_tasks(message, cache.audio, socket_id):
+                scheduler.put(task)
 
         # 还原缓冲区、偏移时长
+        duration = cache.frame_num / 16000 / 4
         cache.chunks = b''
+        cache.audio = b''
         cache.offset = 0
         cache.frame_num = 0
+        cache.endpointer = None
+        cache.segmenter = None
+
+        # 接收长音频时反复拼接缓冲区，留下许多空闲内存，还给系统
+        if duration > Config.trim_after:
+            await to_thread(Cosmic.pool.trim_main)
+
+
+def is_admin(websocket, message) -> bool:
+    """管理指令只接受本机连接，或带有正确 Config.admin_token 的连接"""
+    if websocket.remote_address[0] in ('127.0.0.1', '::1'):
+        return True
+    token = message.get('token', '')
+    return bool(Config.admin_token) and hmac.compare_digest(str(token), Config.admin_token)
+
+
+async def control_handler(websocket, message):
+    """处理控制消息，音频消息不带 type 字段"""
+
+    # 查询调度状态：各来源排队时长、各客户端排队与已识别的音频秒数
+    if message['type'] == 'stats':
+        await websocket.send(json.dumps({
+            'type': 'stats',
+            'wait': Cosmic.scheduler.wait_summary(),
+            'clients': Cosmic.scheduler.client_summary(),
+            'skips': Cosmic.scheduler.skip_summary(),
+            'workers': Cosmic.pool.summary(),
+            'main': Cosmic.pool.main_summary(),
+        }))
+
+    # 客户端取消了录音，放弃识别该任务
+    elif message['type'] == 'cancel':
+        Cosmic.scheduler.cancel(str(websocket.id), message['task_id'])
+        stream_audio(str(websocket.id), message['task_id'], None, True)
+
+    # 管理指令：按 config.py 里新的模型配置换用新模型，不中断服务
+    elif message['type'] == 'swap_model':
+        reply = {'type': 'swap_model'}
+        if not is_admin(websocket, message):
+            reply['state'] = 'denied'
+        elif Cosmic.pool.swapping:
+            reply['state'] = 'busy'
+        elif missing := Cosmic.pool.swap():
+            reply.update(state='missing', missing=missing)
+        else:
+            reply['state'] = 'started'
+        console.print(f'换用新模型请求来自 {websocket.remote_address[0]}：{reply["state"]}', style='yellow')
+        await websocket.send(json.dumps(reply))
 
 
 async def ws_recv(websocket):
@@ -96,12 +279,12 @@ async def ws_recv(websocket):
     sockets_id = Cosmic.sockets_id
     sockets[str(websocket.id)] = websocket
     sockets_id.append(str(websocket.id))
+    Cosmic.scheduler.register(str(websocket.id), websocket.remote_address[0])
     console.print(f'接客了：{websocket}\n', style='yellow')
 
-    # 设定分段长度
-    seg_duration = 15
-    seg_overlap = 2
-    seg_threshold = seg_duration + seg_overlap * 2
+    # 模型因空闲已释放的话，趁客户端还没发音频，提前载入；告诉客户端各模型是否就绪
+    Cosmic.pool.warm()
+    await websocket.send(json.dumps(Cosmic.pool.status()))
 
     # 片段缓冲区、偏移时长
     cache = Cache()
@@ -113,7 +296,13 @@ async def ws_recv(websocket):
             # json 解码字符串
             message = json.loads(message)
 
+            # 处理控制消息
+            if 'type' in message:
+                await control_handler(websocket, message)
+                continue
+
             # 处理数据
+            Cosmic.pool.warm()
             await message_handler(websocket, message, cache)
 
         console.print("ConnectionClosed...", )
@@ -128,3 +317,6 @@ async def ws_recv(websocket):
         status_mic.on = False
         sockets.pop(str(websocket.id))
         sockets_id.remove(str(websocket.id))
+        Cosmic.scheduler.drop_socket(str(websocket.id))
+        stream_audio(str(websocket.id), None, None, True)
+        forget_socket(str(websocket.id))
@@ -1,18 +1,59 @@
 import json 
 import base64 
 import asyncio
+import websockets
 from multiprocessing import Queue
+from typing import Optional
 
+from config import ServerConfig as Config
 from util.server_cosmic import console, Cosmic
-from util.server_classes import Result
+from util.server_classes import Result, REFINE_SUFFIX
 from util.asyncio_to_thread import to_thread
 from rich import inspect
 
 
+# 两遍识别时，初稿与第二遍结果中先到的一方：task_id -> Result
+# 第二遍用的模型不同，可能比初稿先完成，先到的在这里等另一方
+unpaired = {}
+
+
+def find_socket(socket_id: str):
+    return next((ws for ws in Cosmic.sockets.values() if str(ws.id) == socket_id), None)
+
+
+def pair(task_id: str, result: Result) -> Optional[Result]:
+    """取出先到的另一方；本方先到且客户端还连着时，存起来等另一方"""
+    other = unpaired.pop(task_id, None)
+    if other is None and find_socket(result.socket_id):
+        unpaired[task_id] = result
+    return other
+
+
+def forget_socket(socket_id: str):
+    """客户端断开后，丢弃它还在等另一方的结果"""
+    for task_id in [task_id for task_id, result in unpaired.items() if result.socket_id == socket_id]:
+        unpaired.pop(task_id)
+
+
+async def send_correction(draft: Result, result: Result):
+    """两遍识别的初稿已发出、第二遍也识别完成，两者不同时给客户端发修正"""
+    websocket = find_socket(result.socket_id)
+    if result.text == draft.text or not websocket:
+        return
+    await websocket.send(json.dumps({
+        'type': 'correction',
+        'task_id': draft.task_id,
+        'draft': draft.text,
+        'text': result.text,
+        'time_start': result.time_start,
+        'model': result.model,
+    }))
+    console.print(f'修正结果：\n    [green]{result.text}')
+
+
 async def ws_send():
 
     queue_out = Cosmic.queue_out
-    sockets = Cosmic.sockets
 
     while True:
         try:
@@ -23,24 +64,50 @@ async def ws_send():
             if result is None:
                 return
 
+            # 第二遍识别只在完成时对比初稿，中间结果不发
+            if result.source == 'refine':
+                task_id = result.task_id[:-len(REFINE_SUFFIX)]
+                if result.is_final and result.skipped:
+                    unpaired.pop(task_id, None)
+                elif result.is_final and (draft := pair(task_id, result)):
+                    await send_correction(draft, result)
+                continue
+
+            # 两遍识别的初稿，第二遍已先完成的话，初稿发出后再对比
+            # 初稿被放弃的，不必再修正，取消还没识别完的第二遍
+            refined = None
+            if Config.mic_refine and result.source == 'mic' and result.is_final:
+                if result.skipped:
+                    unpaired.pop(result.task_id, None)
+                    Cosmic.scheduler.cancel(result.socket_id, result.task_id + REFINE_SUFFIX)
+                else:
+                    refined = pair(result.task_id, result)
+
+            # 取消、断线或清理产生的结果，客户端不需要
+            if result.skipped and result.skipped != 'expired':
+                continue
+
             # 构建消息
             message = {
                 'task_id': result.task_id,
                 'duration': result.duration,
                 'time_start': result.time_start,
                 'time_submit': result.time_submit,
+                'time_dispatch': result.time_dispatch,
                 'time_complete': result.time_complete,
                 'tokens': result.tokens,
                 'timestamps': result.timestamps,
                 'text': result.text,
                 'is_final': result.is_final,
+                'skipped': result.skipped,
+                'model': result.model,
+                'is_partial': result.is_partial,
+                'seg_duration': result.seg_duration,
+                'seg_overlap': result.seg_overlap,
             }
 
             # 获得 socket
-            websocket = next(
-                (ws for ws in sockets.values() if str(ws.id) == result.socket_id),
-                None,
-            )
+            websocket = find_socket(result.socket_id)
 
             if not websocket:
                 continue
@@ -48,14 +115,39 @@ async def ws_send():
             # 发送消息
             await websocket.send(json.dumps(message))
 
-            if result.source == 'mic':
+            if refined:
+                await send_correction(result, refined)
+
+            # 中间结果很频繁，不打印
+            if result.is_partial:
+                continue
+
+            if result.skipped:
+                console.print(f'    超出时延预算，已放弃识别：{result.task_id}', style='bright_red')
+            elif result.source == 'mic':
                 console.print(f'识别结果：\n    [green]{result.text}')
             elif result.source == 'file':
                 console.print(f'    转录进度：{result.duration:.2f}s', end='\r')
                 if result.is_final:
                     console.print('\n    [green]转录完成')
 
+            # 打印各来源的排队时长
+            if result.is_final:
+                waits = Cosmic.scheduler.wait_summary()
+                console.print('    排队时长：' + '，'.join(
+                    f'{source} 平均 {w["mean"]:.2f}s 最大 {w["max"]:.2f}s'
+                    for source, w in waits.items()), style='dim')
+
         except Exception as e:
             print(e)
 
 
+
+
+async def broadcast(message: dict):
+    """向所有客户端发送状态消息"""
+    for websocket in list(Cosmic.sockets.values()):
+        try:
+            await websocket.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            pass